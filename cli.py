@@ -1,82 +1,524 @@
 #!/usr/bin/env python3
 import argparse
+import itertools
 import os
 import json
+import logging
+import logging.handlers
+import multiprocessing
+import queue
+import sqlite3
+import sys
+import threading
+import time
+import zipfile
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
 
-from core import UltraMetadataExtractor
+from core import FORENSIC_HASHES, UltraMetadataExtractor, load_reverse_geocoder
 
+try:
+    import orjson
+except ImportError:  # optional, fall back to stdlib json
+    orjson = None
 
-def find_images(root, recursive=False):
-    exts = {'.jpg', '.jpeg', '.png', '.tiff', '.tif', '.webp', '.bmp', '.cr2', '.nef', '.arw', '.orf', '.rw2', '.dng'}
+try:
+    from tqdm import tqdm
+except ImportError:  # optional, only needed for --progress
+    tqdm = None
+
+logger = logging.getLogger('cli')
+
+
+IMAGE_EXTS = ('.jpg', '.jpeg', '.png', '.tiff', '.tif', '.webp', '.bmp',
+              '.cr2', '.nef', '.arw', '.orf', '.rw2', '.dng')
+
+# File signatures of the supported formats (TIFF covers CR2/NEF/ARW/DNG)
+_IMAGE_MAGIC = (
+    b'\xff\xd8\xff',             # JPEG
+    b'\x89PNG\r\n\x1a\n',        # PNG
+    b'II*\x00', b'MM\x00*',       # TIFF and TIFF-based RAW
+    b'IIRO', b'IIRS', b'MMOR',    # Olympus ORF
+    b'IIU\x00',                   # Panasonic RW2
+    b'BM',                        # BMP
+)
+
+# A found image with its path pre-split, so nothing downstream re-parses the string
+ImageEntry = namedtuple('ImageEntry', ['path', 'dir', 'stem'])
+
+# Extraction state: one per worker process (set by the pool initializer), or a
+# single instance shared by all threads with --io-workers
+_extractor = None
+_osint = True
+_makernotes = False
+
+
+def _route_logging(log_queue):
+    # Every process (and thread) only enqueues records; one listener prints them
+    root = logging.getLogger()
+    root.handlers[:] = [logging.handlers.QueueHandler(log_queue)]
+    root.setLevel(logging.WARNING)
+
+
+def _init_worker(log_queue, *extractor_args):
+    _route_logging(log_queue)
+    _setup_extractor(*extractor_args)
+
+
+def _setup_extractor(osint, makernotes, hashes, create_map, bruteforce):
+    global _extractor, _osint, _makernotes
+    # Each path is seen once, so the result cache would only cost memory and copies
+    _extractor = UltraMetadataExtractor(hashes=hashes, create_map=create_map, bruteforce=bruteforce,
+                                        cache_results=False)
+    _osint = osint
+    _makernotes = makernotes
+    if osint:
+        _extractor.open_batch()
+
+
+def _extract_one(entry):
+    try:
+        if _osint:
+            return _extractor.extract_osint_metadata(entry.path, _makernotes), None
+        return _extractor.extract_metadata(entry.path, _makernotes), None
+    except Exception as e:
+        return None, str(e)
+
+
+def _extract_batch(entries):
+    # One task per batch keeps pool round-trips down; entries travel with their results
+    return [(entry, *_extract_one(entry)) for entry in entries]
+
+
+def _submit_bounded(ex, entries, workers, batch_size=8):
+    """Yield (entry, data, err) in input order with at most 2 * workers batches in flight"""
+    in_flight = deque()
+    entries = iter(entries)
+    while True:
+        batch = list(itertools.islice(entries, batch_size))
+        if batch:
+            in_flight.append(ex.submit(_extract_batch, batch))
+        if in_flight and (not batch or len(in_flight) >= 2 * workers):
+            yield from in_flight.popleft().result()
+        elif not batch:
+            return
+
+
+def _scan_dir(path):
+    files, subdirs = [], []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                # DirEntry caches the d_type from readdir, so these checks cost no stat()
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                elif entry.is_file():
+                    # str.endswith with a tuple is a single C call; the leading
+                    # character check mirrors splitext() ignoring dotfiles like ".jpg"
+                    name = entry.name.lower()
+                    dot = name.rfind('.')
+                    if dot > 0 and name.endswith(IMAGE_EXTS):
+                        files.append(ImageEntry(entry.path, path, entry.name[:dot]))
+    except OSError:
+        pass
+    return files, subdirs
+
+
+def _sniff_image(path):
+    # 16 bytes are enough for every signature above; a plain read is cheaper
+    # than mapping a page for them and also works on files shorter than that
+    try:
+        with open(path, 'rb') as f:
+            head = f.read(16)
+    except OSError:
+        return False
+    return head.startswith(_IMAGE_MAGIC) or (head[:4] == b'RIFF' and head[8:12] == b'WEBP')
+
+
+def find_images(root, recursive=False, workers=8):
     if os.path.isfile(root):
-        yield root
+        dirname, name = os.path.split(root)
+        yield ImageEntry(root, dirname, os.path.splitext(name)[0])
         return
     if not os.path.exists(root):
         return
 
-    if recursive:
-        for dirpath, dirs, files in os.walk(root):
-            for f in files:
-                if os.path.splitext(f)[1].lower() in exts:
-                    yield os.path.join(dirpath, f)
-    else:
-        for f in os.listdir(root):
-            full = os.path.join(root, f)
-            if os.path.isfile(full) and os.path.splitext(f)[1].lower() in exts:
-                yield full
-
-
-def write_json(metadata, src_path, out_dir=None, suffix='_metadata'):
-    base = os.path.basename(src_path)
-    name = os.path.splitext(base)[0]
-    out_name = f"{name}{suffix}.json"
-    if out_dir:
-        os.makedirs(out_dir, exist_ok=True)
-        out_path = os.path.join(out_dir, out_name)
-    else:
-        out_path = os.path.join(os.path.dirname(src_path), out_name)
+    if not recursive:
+        yield from _scan_dir(root)[0]
+        return
 
-    payload = {
-        'source_file': os.path.abspath(src_path),
-        'extracted_at': datetime.now().isoformat(),
-        'metadata': metadata
+    # Directories are listed concurrently; files are yielded as soon as their
+    # directory is read, so extraction starts before the walk is finished
+    results = queue.Queue()
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        def submit(path):
+            ex.submit(_scan_dir, path).add_done_callback(results.put)
+
+        submit(root)
+        pending = 1
+        while pending:
+            files, subdirs = results.get().result()
+            pending -= 1
+            for d in subdirs:
+                submit(d)
+            pending += len(subdirs)
+            yield from files
+
+
+def _dumps(obj, pretty=True):
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        if pretty:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, option=option)
+    if pretty:
+        return json.dumps(obj, indent=2, ensure_ascii=False, default=_json_default).encode('utf-8')
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False, default=_json_default).encode('utf-8')
+
+
+def _json_default(obj):
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def _dest_path(entry, out_dir=None, suffix='_metadata'):
+    return os.path.join(out_dir or entry.dir, f"{entry.stem}{suffix}.json")
+
+
+def _is_up_to_date(entry, out_dir=None, max_age=0):
+    try:
+        src = os.stat(entry.path)
+        dst = os.stat(_dest_path(entry, out_dir))
+    except OSError:
+        return False
+    if dst.st_mtime < src.st_mtime:
+        return False
+    if max_age and time.time() - dst.st_mtime > max_age:
+        return False
+    return True
+
+
+def write_json(metadata, entry, out_dir=None, suffix='_metadata'):
+    # entry.path is expected to be absolute and out_dir to exist (see main())
+    out_path = _dest_path(entry, out_dir, suffix)
+
+    header = {
+        'source_file': entry.path,
+        'extracted_at': datetime.now(),
     }
-    with open(out_path, 'w', encoding='utf-8') as f:
-        json.dump(payload, f, indent=2, ensure_ascii=False)
+    # Stream the document entry by entry instead of building one big string:
+    # only a single metadata value is serialized at a time
+    with open(out_path, 'wb', buffering=1 << 20) as f:
+        f.write(_dumps(header)[:-2])
+        f.write(b',\n  "metadata": {')
+        sep = b'\n    '
+        for key, value in metadata.items():
+            name = json.dumps(str(key), ensure_ascii=False).encode('utf-8')
+            f.write(sep + name + b': ' + _dumps(value).replace(b'\n', b'\n    '))
+            sep = b',\n    '
+        f.write(b'\n  }\n}' if metadata else b'}\n}')
     return out_path
 
 
+class ProgressState:
+    """Resumable run log: (path, mtime, size, status) per image in a SQLite file"""
+
+    _COMMIT_EVERY = 64
+
+    def __init__(self, path):
+        # Marked from the writer thread and read from the main one, hence the lock
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS images '
+                         '(path TEXT PRIMARY KEY, mtime REAL, size INTEGER, status TEXT)')
+        self._lock = threading.Lock()
+        self._uncommitted = 0
+
+    def is_done(self, entry):
+        try:
+            st = os.stat(entry.path)
+        except OSError:
+            return False
+        with self._lock:
+            row = self._db.execute('SELECT mtime, size, status FROM images WHERE path = ?',
+                                   (entry.path,)).fetchone()
+        return row == (st.st_mtime, st.st_size, 'ok')
+
+    def mark(self, entry, status):
+        try:
+            st = os.stat(entry.path)
+        except OSError:
+            return
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?)',
+                             (entry.path, st.st_mtime, st.st_size, status))
+            self._uncommitted += 1
+            if self._uncommitted >= self._COMMIT_EVERY:
+                self._db.commit()
+                self._uncommitted = 0
+
+    def close(self):
+        with self._lock:
+            self._db.commit()
+            self._db.close()
+
+
+def _payload(metadata, entry):
+    return {
+        'source_file': entry.path,
+        'extracted_at': datetime.now(),
+        'metadata': metadata
+    }
+
+
+class SidecarWriter:
+    """One <name>_metadata.json per image, next to it or in out_dir"""
+
+    def __init__(self, out_dir=None):
+        self.out_dir = out_dir
+        if out_dir:
+            os.makedirs(out_dir, exist_ok=True)
+
+    def write(self, metadata, entry):
+        return write_json(metadata, entry, out_dir=self.out_dir)
+
+    def close(self):
+        pass
+
+
+class JsonlWriter:
+    """All payloads appended to a single JSON Lines file"""
+
+    def __init__(self, path, fsync_every=0):
+        self.path = path
+        self.fsync_every = fsync_every
+        self._f = open(path, 'ab', buffering=1 << 20)
+        self._unsynced = 0
+
+    def write(self, metadata, entry):
+        self._f.write(_dumps(_payload(metadata, entry), pretty=False) + b'\n')
+        self._unsynced += 1
+        if self.fsync_every and self._unsynced >= self.fsync_every:
+            self._sync()
+        return self.path
+
+    def _sync(self):
+        self._f.flush()
+        os.fsync(self._f.fileno())
+        self._unsynced = 0
+
+    def close(self):
+        if self.fsync_every and self._unsynced:
+            self._sync()
+        self._f.close()
+
+
+class ZipWriter:
+    """All payloads stored as members of a single uncompressed ZIP archive"""
+
+    def __init__(self, path, root):
+        self.path = path
+        self.root = root if os.path.isdir(root) else os.path.dirname(root)
+        self._zip = zipfile.ZipFile(path, 'w', zipfile.ZIP_STORED)
+
+    def write(self, metadata, entry):
+        member = os.path.relpath(_dest_path(entry), self.root)
+        self._zip.writestr(member, _dumps(_payload(metadata, entry)))
+        return f"{self.path}:{member}"
+
+    def close(self):
+        self._zip.close()
+
+
 def main():
+    # Only the log listener thread writes to stdout, so it does not need line buffering;
+    # this has to happen before anything is written
+    if hasattr(sys.stdout, 'reconfigure'):
+        sys.stdout.reconfigure(line_buffering=False, write_through=False)
     parser = argparse.ArgumentParser(description='CLI extractor for MetaDate-JOOT')
     parser.add_argument('path', help='Image file or directory to process')
     parser.add_argument('--recursive', '-r', action='store_true', help='Recurse directories')
     parser.add_argument('--no-osint', action='store_true', help='Disable OSINT enhancements (network/geocoding)')
+    parser.add_argument('--makernotes', action='store_true',
+                        help='Also decode vendor MakerNotes and RAW SubIFDs (much slower)')
+    parser.add_argument('--bruteforce', action='store_true',
+                        help='Search the whole file for XMP/IPTC, not just its first 128 KB (512 KB for RAW)')
     parser.add_argument('--out', '-o', help='Output directory for JSON files')
+    parser.add_argument('--hashes', nargs='+', choices=list(FORENSIC_HASHES), default=list(FORENSIC_HASHES),
+                        help='File digests computed in OSINT mode (default: all); e.g. --hashes sha256')
+    parser.add_argument('--map', action='store_true',
+                        help='Also write an HTML map of the GPS location in OSINT mode (one temp file per '
+                             'geotagged image, path in OSINT_Map_File; not cleaned up)')
+    batch_out = parser.add_mutually_exclusive_group()
+    batch_out.add_argument('--jsonl', metavar='FILE', help='Append all results to one JSON Lines file instead of sidecars')
+    batch_out.add_argument('--zip', metavar='FILE', help='Store all results in one ZIP archive instead of sidecars')
+    parser.add_argument('--fsync-every', type=int, default=0, metavar='N',
+                        help='With --jsonl, fsync after every N records (0 = only flush on exit)')
     parser.add_argument('--limit', type=int, default=0, help='Limit number of files processed (0 = no limit)')
+    parser.add_argument('--workers', '-j', type=int, default=os.cpu_count(),
+                        help='Worker processes for extraction (default: CPU count)')
+    parser.add_argument('--io-workers', type=int, default=0,
+                        help='Use N threads instead of processes (for network-bound OSINT runs)')
+    parser.add_argument('--state', metavar='FILE',
+                        help='SQLite progress log; images already recorded as done are skipped on rerun')
+    parser.add_argument('--sniff', action='store_true',
+                        help='Skip files whose header does not match a supported image format')
+    parser.add_argument('--force', action='store_true',
+                        help='Re-extract even if an up-to-date JSON file already exists')
+    parser.add_argument('--refresh-if-older-than', type=float, default=0, metavar='SECONDS',
+                        help='Re-extract when the existing JSON file is older than this (0 = never)')
+    parser.add_argument('--quiet', '-q', action='store_true', help='Only report failures')
+    parser.add_argument('--progress', action='store_true',
+                        help='Show a progress bar instead of per-file messages (requires tqdm)')
 
     args = parser.parse_args()
 
-    extractor = UltraMetadataExtractor()
+    # Worker processes need a multiprocessing queue; threads can share a plain one
+    log_queue = queue.Queue() if args.io_workers else multiprocessing.Queue()
+    _route_logging(log_queue)
+    logger.setLevel(logging.WARNING if args.quiet else logging.INFO)
+    out = logging.StreamHandler(sys.stdout)
+    out.addFilter(lambda record: record.levelno < logging.WARNING)
+    err = logging.StreamHandler(sys.stderr)
+    err.setLevel(logging.WARNING)
+    listener = logging.handlers.QueueListener(log_queue, out, err, respect_handler_level=True)
+    listener.start()
+    try:
+        _run(args, log_queue)
+    finally:
+        listener.stop()
+
+
+def _run(args, log_queue):
+    # Resolve the root once: every path found under it is then already absolute
+    root = os.path.abspath(args.path)
+    images = find_images(root, recursive=args.recursive)
+    state = ProgressState(args.state) if args.state else None
+    skipped = 0
+    rejected = 0
+    if args.sniff:
+        def sniffed(entries):
+            nonlocal rejected
+            for entry in entries:
+                if _sniff_image(entry.path):
+                    yield entry
+                else:
+                    rejected += 1
+        images = sniffed(images)
+    if state and not args.force:
+        def unfinished(entries):
+            nonlocal skipped
+            for entry in entries:
+                if state.is_done(entry):
+                    skipped += 1
+                    continue
+                yield entry
+        images = unfinished(images)
+    # Freshness can only be checked against per-image sidecars
+    if not (args.force or args.jsonl or args.zip):
+        def pending(entries):
+            nonlocal skipped
+            for entry in entries:
+                if _is_up_to_date(entry, args.out, args.refresh_if_older_than):
+                    skipped += 1
+                    continue
+                yield entry
+        images = pending(images)
+    if args.limit:
+        images = itertools.islice(images, args.limit)
+
+    extractor_args = (not args.no_osint, args.makernotes, args.hashes, args.map,
+                      args.bruteforce)
+    if not args.no_osint:
+        # Build the offline geocoder's KD-tree before the pool starts: forked
+        # workers inherit it instead of each loading the cities file again
+        load_reverse_geocoder()
+    if args.io_workers:
+        # A thread-pool initializer would run once per thread and each run would
+        # replace the module globals; build the one shared extractor up front instead
+        _setup_extractor(*extractor_args)
+        executor = ThreadPoolExecutor(max_workers=args.io_workers)
+    else:
+        executor = ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker,
+                                       initargs=(log_queue, *extractor_args))
+
+    if args.jsonl:
+        writer = JsonlWriter(args.jsonl, fsync_every=args.fsync_every)
+    elif args.zip:
+        writer = ZipWriter(args.zip, root)
+    else:
+        writer = SidecarWriter(args.out)
+
+    bar = None
+    if args.progress:
+        if tqdm is None:
+            logger.warning("--progress needs tqdm (pip install tqdm); showing per-file messages")
+        else:
+            bar = tqdm(unit='img', disable=args.quiet)
+    per_file = not args.quiet and bar is None
 
     count = 0
-    for img in find_images(args.path, recursive=args.recursive):
-        if args.limit and count >= args.limit:
-            break
-        try:
-            print(f"Processing: {img}")
-            if args.no_osint:
-                data = extractor.extract_metadata(img)
+    # Serialization and disk writes run on their own thread, so a slow write
+    # never holds up collecting the next extraction result
+    results = queue.Queue(maxsize=64)
+
+    def write_results():
+        while True:
+            item = results.get()
+            if item is None:
+                break
+            entry, data, err = item
+            if err is not None:
+                logger.error("Failed %s: %s", entry.path, err)
+                if state:
+                    state.mark(entry, 'failed')
             else:
-                data = extractor.extract_osint_metadata(img)
+                write_one(entry, data)
+            if bar is not None:
+                bar.update()
 
-            out_path = write_json(data, img, out_dir=args.out)
-            print(f"Saved metadata -> {out_path}\n")
+    def write_one(entry, data):
+        nonlocal count
+        try:
+            out_path = writer.write(data, entry)
+            if per_file:
+                logger.info("Saved metadata: %s -> %s", entry.path, out_path)
             count += 1
+            if state:
+                state.mark(entry, 'ok')
         except Exception as e:
-            print(f"Failed {img}: {e}")
+            logger.error("Failed %s: %s", entry.path, e)
+            if state:
+                state.mark(entry, 'failed')
+
+    write_thread = threading.Thread(target=write_results, daemon=True)
+    write_thread.start()
+    try:
+        with executor as ex:
+            # Tasks are submitted only as results drain, so neither the pending
+            # futures nor the walk outrun the writer queue on large trees
+            workers = args.io_workers or args.workers or os.cpu_count() or 1
+            for item in _submit_bounded(ex, images, workers):
+                results.put(item)
+    finally:
+        results.put(None)
+        write_thread.join()
+        if bar is not None:
+            bar.close()
+        writer.close()
+        if state:
+            state.close()
+        # Thread workers share this process's extractor; process workers exit with the pool
+        if _extractor is not None:
+            _extractor.close_batch()
 
-    print(f"Done. Processed: {count}")
+    summary = f"Done. Processed: {count}, up to date: {skipped}"
+    if args.sniff:
+        summary += f", not images: {rejected}"
+    logger.info(summary)
 
 
 if __name__ == '__main__':
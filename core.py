@@ -1,50 +1,185 @@
 import exifread
-from PIL import Image, ExifTags, ImageCms
+from PIL import Image, ExifTags
+from PIL.TiffImagePlugin import IFDRational
 import piexif
 import os
 import logging
-import json
 import io
-import requests
-import reverse_geocoder as rg
-from geopy.geocoders import Nominatim
+import re
 import hashlib
-import folium
-import webbrowser
 import tempfile
+import functools
+import contextlib
+import mmap
+import zlib
+import string
+import math
+import threading
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from fractions import Fraction
+from collections import OrderedDict
+
+try:
+    import diskcache  # необязательно: кэш геокодирования между запусками
+except ImportError:
+    diskcache = None
+
+try:
+    import pyexiv2  # необязательно: разбор EXIF через libexiv2 (C++) вместо exifread
+    pyexiv2.set_log_level(4)
+except ImportError:
+    pyexiv2 = None
 
 logger = logging.getLogger(__name__)
 
+# Криминалистические хеши: алгоритм hashlib -> ключ в метаданных
+FORENSIC_HASHES = {
+    'md5': "OSINT_MD5_Hash",
+    'sha1': "OSINT_SHA1_Hash",
+    'sha256': "OSINT_SHA256_Hash",
+}
+
+# Доли градуса: умножение дешевле деления
+_DEG_PER_MINUTE = 1 / 60.0
+_DEG_PER_SECOND = 1 / 3600.0
+
+def _ratio_value(value):
+    """Число из Ratio/IFDRational одним делением, без вызова __float__"""
+    numerator = getattr(value, 'numerator', None)
+    if numerator is not None:
+        return numerator / value.denominator
+    return float(value)
+
+_reverse_disk_cache = None
+
+def _get_reverse_disk_cache():
+    """Дисковый кэш обратного геокодирования (если установлен diskcache)"""
+    global _reverse_disk_cache
+    if diskcache is not None and _reverse_disk_cache is None:
+        _reverse_disk_cache = diskcache.Cache(os.path.expanduser('~/.cache/metadate'))
+    return _reverse_disk_cache
+
+@functools.lru_cache(maxsize=None)
+def _get_geolocator():
+    """Один Nominatim на процесс: общая requests.Session держит TLS-соединение открытым"""
+    from geopy.geocoders import Nominatim
+    from geopy.adapters import RequestsAdapter
+    # Небольшой таймаут чтобы сетевые запросы не висели бесконечно
+    return Nominatim(user_agent="metadate_joot", timeout=5, scheme='https',
+                     adapter_factory=RequestsAdapter)
+
+@functools.lru_cache(maxsize=1024)
+def _iso_timestamp(timestamp):
+    """datetime.fromtimestamp(...).isoformat() с кэшем: ctime/mtime часто совпадают"""
+    return datetime.fromtimestamp(timestamp).isoformat()
+
+@functools.lru_cache(maxsize=None)
+def load_reverse_geocoder():
+    """Офлайн-геокодер reverse_geocoder: KD-дерево городов строится один раз на процесс"""
+    import reverse_geocoder as rg  # тяжёлый импорт (numpy/scipy) - только когда нужен
+    # mode=1 - поиск в текущем процессе: mode=2 заводит свой пул процессов,
+    # а это невозможно внутри рабочих процессов CLI
+    return rg.RGeocoder(mode=1, verbose=False)
+
+# Адреса по округлённым координатам ('reverse', lat_q, lon_q) -> location (LRU в памяти);
+# сюда же кладёт результаты пакетная геокодировка OSINTEnhancer.enhance_many
+_REVERSE_MEMO_SIZE = 4096
+_reverse_memo = OrderedDict()
+_reverse_memo_lock = threading.Lock()
+
+def _reverse_known(key):
+    """(True, location), если адрес уже есть в памяти или на диске, иначе (False, None)"""
+    with _reverse_memo_lock:
+        if key in _reverse_memo:
+            _reverse_memo.move_to_end(key)
+            return True, _reverse_memo[key]
+    disk = _get_reverse_disk_cache()
+    if disk is not None:
+        location = disk.get(key)
+        if location is not None:
+            _remember_reverse(key, location)
+            return True, location
+    return False, None
+
+def _remember_reverse(key, location):
+    """Запомнить адрес в памяти, вытесняя самые старые сверх _REVERSE_MEMO_SIZE"""
+    with _reverse_memo_lock:
+        _reverse_memo[key] = location
+        _reverse_memo.move_to_end(key)
+        while len(_reverse_memo) > _REVERSE_MEMO_SIZE:
+            _reverse_memo.popitem(last=False)
+
+def _reverse_cached(geolocator, lat_q, lon_q):
+    """Nominatim.reverse с кэшем по округлённым координатам (4 знака ~ 11 м)"""
+    key = ('reverse', lat_q, lon_q)
+    known, location = _reverse_known(key)
+    if known:
+        return location
+    
+    location = geolocator.reverse(f"{lat_q}, {lon_q}", language='en')
+    _remember_reverse(key, location)
+    disk = _get_reverse_disk_cache()
+    if disk is not None and location is not None:
+        disk.set(key, location)
+    return location
+
+@contextlib.contextmanager
+def _map_file(path):
+    """Файл целиком через mmap (только чтение); для пустого файла - b''"""
+    with open(path, 'rb') as f, _map_fileobj(f) as mm:
+        yield mm
+
+@contextlib.contextmanager
+def _map_fileobj(f):
+    """mmap уже открытого файла (только чтение); для пустого файла - b''"""
+    # mmap нулевой длины создать нельзя
+    if os.fstat(f.fileno()).st_size == 0:
+        yield b''
+        return
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        yield mm
+
 class OSINTEnhancer:
     """OSINT-усилитель для метаданных"""
     
-    def __init__(self):
-        # Небольшой таймаут чтобы сетевые запросы не висели бесконечно
-        self.geolocator = Nominatim(user_agent="metadate_joot", timeout=5)
+    def __init__(self, hashes=tuple(FORENSIC_HASHES), create_map=True):
+        self.geolocator = _get_geolocator()
+        # Только доступные в этой сборке OpenSSL алгоритмы
+        self.hashes = [h for h in hashes if h in FORENSIC_HASHES and h in hashlib.algorithms_available]
+        # HTML-карта нужна только для просмотра (GUI); пакетной обработке можно без неё
+        self.create_map = create_map
     
-    def enhance_metadata(self, metadata, image_path):
-        """Добавляет OSINT-данные к метаданным"""
+    def enhance_metadata(self, metadata, image_path, stat=None):
+        """Добавляет OSINT-данные к метаданным (stat - уже полученный os.stat файла)"""
         enhanced = metadata.copy()
+        # Один индекс по ключам в нижнем регистре на все анализы: key_lower -> (key, value)
+        index = self._build_index(metadata)
         
         try:
+            # Координаты ищем один раз - нужны и GPS анализу, и карте
+            coords = self._extract_coordinates(index)
+            
             # 1. GPS анализ и геолокация
-            enhanced.update(self._gps_osint_analysis(metadata))
+            enhanced.update(self._gps_osint_analysis(index, coords))
             
             # 2. Анализ камеры и устройства
-            enhanced.update(self._camera_osint_analysis(metadata))
+            enhanced.update(self._camera_osint_analysis(index))
             
             # 3. Временной анализ
-            enhanced.update(self._time_analysis(metadata))
+            # Ссылки, email и годы ищутся одним проходом по значениям (для п. 3 и 5)
+            found = self._scan_values(index)
+            enhanced.update(self._time_analysis(index, found))
             
             # 4. Хеши и идентификаторы
-            enhanced.update(self._forensic_analysis(image_path))
+            enhanced.update(self._forensic_analysis(image_path, stat))
             
             # 5. Сетевой анализ (если есть ссылки)
-            enhanced.update(self._network_analysis(metadata))
+            enhanced.update(self._network_analysis(found))
             
             # 6. Создание карты
-            map_path = self._create_osm_map(metadata)
+            map_path = self._create_osm_map(coords) if self.create_map else None
             if map_path:
                 enhanced["OSINT_Map_File"] = map_path
                 
@@ -53,20 +188,71 @@ class OSINTEnhancer:
             
         return enhanced
     
-    def _gps_osint_analysis(self, metadata):
+    @staticmethod
+    def _build_index(metadata):
+        """Индекс метаданных по ключам в нижнем регистре (порядок ключей сохраняется)"""
+        return {key.lower(): (key, value) for key, value in metadata.items()}
+    
+    async def enhance_many(self, items):
+        """Пакетный OSINT для списка (metadata, image_path): адреса запрашиваются заранее, асинхронно"""
+        items = list(items)
+        pending = set()
+        for metadata, _ in items:
+            coords = self._extract_coordinates(self._build_index(metadata))
+            if coords:
+                pending.add((round(coords[0], 4), round(coords[1], 4)))
+        if pending:
+            await self._prefetch_reverse(pending)
+        # Сам анализ блокирующий (хеши, карта, диск) - выполняем вне цикла событий
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            None, lambda: [self.enhance_metadata(metadata, image_path) for metadata, image_path in items])
+    
+    async def _prefetch_reverse(self, coords):
+        """Обратная геокодировка всех координат через aiohttp с лимитом Nominatim (1 запрос/с)"""
+        try:
+            from geopy.geocoders import Nominatim
+            from geopy.adapters import AioHTTPAdapter
+            from geopy.extra.rate_limiter import AsyncRateLimiter
+        except ImportError:
+            return
+        # Уже известные (в памяти или в diskcache) адреса повторно не запрашиваем
+        coords = [c for c in coords if not _reverse_known(('reverse',) + c)[0]]
+        if not coords:
+            return
+        # Без aiohttp адреса будут запрошены по одному в enhance_metadata
+        try:
+            async with Nominatim(user_agent="metadate_joot", timeout=5,
+                                 adapter_factory=AioHTTPAdapter) as geolocator:
+                reverse = AsyncRateLimiter(geolocator.reverse, min_delay_seconds=1.0)
+                locations = await asyncio.gather(
+                    *[reverse(f"{lat}, {lon}", language='en') for lat, lon in coords],
+                    return_exceptions=True)
+        except ImportError:
+            # geopy проверяет наличие aiohttp только при создании адаптера
+            return
+        except Exception as e:
+            logger.warning("Async geocoding: %s", e)
+            return
+        disk = _get_reverse_disk_cache()
+        for (lat, lon), location in zip(coords, locations):
+            if location is None or isinstance(location, Exception):
+                continue
+            _remember_reverse(('reverse', lat, lon), location)
+            if disk is not None:
+                disk.set(('reverse', lat, lon), location)
+    
+    def _gps_osint_analysis(self, index, coords):
         """Углубленный GPS анализ для OSINT"""
         gps_data = {}
         
         try:
-            # Ищем координаты в разных форматах
-            coords = self._extract_coordinates(metadata)
-            
             if coords:
                 lat, lon = coords
                 gps_data["OSINT_Coordinates"] = f"{lat:.6f}, {lon:.6f}"
                 
-                # 1. Обратная геокодировка - получаем адрес
-                location = self.geolocator.reverse(f"{lat}, {lon}", language='en')
+                # 1. Обратная геокодировка - получаем адрес (один запрос, с кэшем)
+                location = self._reverse(lat, lon)
                 if location:
                     address = location.raw.get('address', {})
                     gps_data["OSINT_Country"] = address.get('country', 'Unknown')
@@ -79,7 +265,7 @@ class OSINTEnhancer:
                 
                 # 2. Reverse geocoding через alternative service
                 try:
-                    results = rg.search((lat, lon))
+                    results = load_reverse_geocoder().query([(lat, lon)])
                     if results:
                         result = results[0]
                         gps_data["OSINT_RG_Country"] = result.get('cc', 'Unknown')
@@ -97,18 +283,18 @@ class OSINTEnhancer:
                 gps_data["OSINT_What3Words"] = f"https://what3words.com///{self._coord_to_3words(lat, lon)}"
                 
                 # 4. Высота и временная зона (если есть)
-                if 'GPS GPSAltitude' in str(metadata):
+                if any('gps gpsaltitude' in key_lower for key_lower in index):
                     gps_data["OSINT_Altitude_Analysis"] = "Altitude data available"
                 
                 # 5. Анализ местности
-                gps_data["OSINT_Location_Type"] = self._analyze_location_type(lat, lon)
+                gps_data["OSINT_Location_Type"] = self._analyze_location_type(location)
                 
         except Exception as e:
             gps_data["OSINT_GPS_Error"] = str(e)
             
         return gps_data
     
-    def _camera_osint_analysis(self, metadata):
+    def _camera_osint_analysis(self, index):
         """Анализ камеры и устройства для OSINT"""
         camera_data = {}
         
@@ -118,8 +304,7 @@ class OSINTEnhancer:
             model = None
             serial = None
             
-            for key, value in metadata.items():
-                key_lower = key.lower()
+            for key_lower, (key, value) in index.items():
                 if 'make' in key_lower and not make:
                     make = str(value)
                 elif 'model' in key_lower and not model:
@@ -142,7 +327,7 @@ class OSINTEnhancer:
                 camera_data["OSINT_Device_Search"] = f"https://www.google.com/search?q={make}+{model}+camera"
                 
             # Анализ объектива
-            lens_info = self._extract_lens_info(metadata)
+            lens_info = self._extract_lens_info(index)
             if lens_info:
                 camera_data["OSINT_Lens_Info"] = lens_info
             
@@ -151,17 +336,31 @@ class OSINTEnhancer:
             
         return camera_data
     
-    def _time_analysis(self, metadata):
+    # Ссылки, email-подобные строки и годы 201x/202x - одно регулярное выражение на значение
+    _SCAN_RE = re.compile(r'(?P<url>https?://)|(?P<email>[\w.+-]+@[\w-]+(?:\.[\w-]+)+)|(?P<year>20[12]\d)',
+                          re.IGNORECASE)
+    
+    def _scan_values(self, index):
+        """Один проход по всем значениям: key_lower -> (key, str_value, найденные типы)"""
+        found = {}
+        for key_lower, (key, value) in index.items():
+            str_value = str(value)
+            kinds = {match.lastgroup for match in self._SCAN_RE.finditer(str_value)}
+            if kinds:
+                found[key_lower] = (key, str_value, kinds)
+        return found
+    
+    def _time_analysis(self, index, found):
         """Анализ временных меток для OSINT"""
         time_data = {}
         
         try:
             # Ищем все временные метки
             timestamps = []
-            for key, value in metadata.items():
-                if any(time_key in key.lower() for time_key in ['date', 'time']):
-                    if '202' in str(value) or '201' in str(value):  # Фильтр для дат
-                        timestamps.append((key, str(value)))
+            for key_lower, (key, str_value, kinds) in found.items():
+                if 'date' in key_lower or 'time' in key_lower:
+                    if 'year' in kinds:  # Фильтр для дат
+                        timestamps.append((key, str_value))
             
             if timestamps:
                 time_data["OSINT_Timestamps_Found"] = len(timestamps)
@@ -173,8 +372,8 @@ class OSINTEnhancer:
                     time_data["OSINT_Time_Analysis"] = "Multiple timestamps - timeline available"
             
             # Анализ временной зоны
-            for key, value in metadata.items():
-                if 'timezone' in key.lower():
+            for key_lower, (key, value) in index.items():
+                if 'timezone' in key_lower:
                     time_data["OSINT_Timezone"] = value
                     break
                     
@@ -183,24 +382,27 @@ class OSINTEnhancer:
             
         return time_data
     
-    def _forensic_analysis(self, image_path):
+    def _forensic_analysis(self, image_path, stat=None):
         """Криминалистический анализ файла"""
         forensic_data = {}
         
         try:
-            # Хеши файла
-            with open(image_path, 'rb') as f:
-                file_data = f.read()
-                
-            forensic_data["OSINT_MD5_Hash"] = hashlib.md5(file_data).hexdigest()
-            forensic_data["OSINT_SHA1_Hash"] = hashlib.sha1(file_data).hexdigest()
-            forensic_data["OSINT_SHA256_Hash"] = hashlib.sha256(file_data).hexdigest()
+            # Хеши файла - по отображению в память, без копирования файла в bytes
+            # usedforsecurity=False: это отпечатки, а не защита - OpenSSL пропускает FIPS-обёртки
+            hashers = {FORENSIC_HASHES[name]: hashlib.new(name, usedforsecurity=False)
+                       for name in self.hashes}
+            with _map_file(image_path) as data:
+                for h in hashers.values():
+                    h.update(data)
+            
+            for key, h in hashers.items():
+                forensic_data[key] = h.hexdigest()
             
             # Размер и характеристики
-            file_stats = os.stat(image_path)
+            file_stats = stat or os.stat(image_path)
             forensic_data["OSINT_File_Size_Bytes"] = file_stats.st_size
-            forensic_data["OSINT_File_Created"] = datetime.fromtimestamp(file_stats.st_ctime).isoformat()
-            forensic_data["OSINT_File_Modified"] = datetime.fromtimestamp(file_stats.st_mtime).isoformat()
+            forensic_data["OSINT_File_Created"] = _iso_timestamp(file_stats.st_ctime)
+            forensic_data["OSINT_File_Modified"] = _iso_timestamp(file_stats.st_mtime)
             
             # Анализ имени файла
             filename = os.path.basename(image_path)
@@ -213,21 +415,19 @@ class OSINTEnhancer:
             
         return forensic_data
     
-    def _network_analysis(self, metadata):
+    def _network_analysis(self, found):
         """Анализ сетевых данных"""
         network_data = {}
         
         try:
-            # Ищем URL, IP, email в метаданных
-            for key, value in metadata.items():
-                str_value = str(value)
-                
+            # Ищем URL, IP, email в метаданных (см. _scan_values)
+            for key, str_value, kinds in found.values():
                 # Поиск URL
-                if 'http' in str_value.lower():
+                if 'url' in kinds:
                     network_data[f"OSINT_URL_In_{key}"] = str_value
                 
                 # Поиск email-подобных строк
-                if '@' in str_value and '.' in str_value:
+                if 'email' in kinds:
                     network_data[f"OSINT_Email_Like_In_{key}"] = str_value
                     
         except Exception as e:
@@ -235,44 +435,77 @@ class OSINTEnhancer:
             
         return network_data
     
-    def _create_osm_map(self, metadata):
+    def _create_osm_map(self, coords):
         """Создает OSM карту с локацией"""
         try:
-            coords = self._extract_coordinates(metadata)
             if not coords:
                 return None
                 
             lat, lon = coords
             
-            # Создаем карту
+            # HTML карты отличается только координатами - подставляем их в готовый шаблон
+            html = self._map_template()
+            html = html.replace(self._MAP_LAT_SENTINEL, repr(float(lat)))
+            html = html.replace(self._MAP_LON_SENTINEL, repr(float(lon)))
+            
+            # Сохраняем в новый временный файл - параллельные обработчики с одинаковыми
+            # координатами не пишут в один и тот же файл
+            with tempfile.NamedTemporaryFile('w', encoding='utf-8', prefix='metadate_map_',
+                                             suffix='.html', delete=False) as f:
+                f.write(html)
+            
+            return f.name
+            
+        except Exception as e:
+            return None
+    
+    # Координаты-заглушки, которые заменяются в HTML шаблоне карты
+    _MAP_LAT_SENTINEL = '12.3456789'
+    _MAP_LON_SENTINEL = '98.7654321'
+    _map_html = None
+    
+    @classmethod
+    def _map_template(cls):
+        """HTML карты folium, отрисованный один раз с координатами-заглушками"""
+        if cls._map_html is None:
+            import folium  # тянет jinja2/branca - импортируем только когда нужна карта
+            lat, lon = float(cls._MAP_LAT_SENTINEL), float(cls._MAP_LON_SENTINEL)
             m = folium.Map(location=[lat, lon], zoom_start=15)
             
-            # Добавляем маркер
             # Добавляем простой маркер (избегаем зависимостей на FA icons)
             folium.Marker(
                 [lat, lon],
                 popup="Photo Location",
                 tooltip="GPS from EXIF",
             ).add_to(m)
-            
-            # Сохраняем во временный файл
-            temp_dir = tempfile.gettempdir()
-            map_path = os.path.join(temp_dir, f"metadate_map_{hashlib.md5(f'{lat}{lon}'.encode()).hexdigest()}.html")
-            m.save(map_path)
-            
-            return map_path
-            
-        except Exception as e:
-            return None
+            cls._map_html = m.get_root().render()
+        return cls._map_html
     
-    def _extract_coordinates(self, metadata):
+    # Ключи (в нижнем регистре) со строкой "lat, lon"
+    _KNOWN_COORD_KEYS = ('gps_coordinates', 'osint_coordinates')
+    
+    def _extract_coordinates(self, index):
         """Извлекает координаты из метаданных"""
         try:
             lat, lon = None, None
             
+            # Быстрый путь: ключи, которые пишут _detailed_gps и сам OSINT-анализ
+            try:
+                return (float(index['gps_latitude_decimal'][1]),
+                        float(index['gps_longitude_decimal'][1]))
+            except (KeyError, TypeError, ValueError):
+                pass
+            for key_lower in self._KNOWN_COORD_KEYS:
+                if key_lower in index:
+                    try:
+                        lat, lon = (float(part) for part in str(index[key_lower][1]).split(','))
+                        return (lat, lon)
+                    except ValueError:
+                        lat, lon = None, None
+            
+            # Медленный путь - просмотр всех ключей
             # Ищем в разных форматах
-            for key, value in metadata.items():
-                key_lower = key.lower()
+            for key_lower, (key, value) in index.items():
                 if 'gps' in key_lower and 'decimal' in key_lower:
                     if 'latitude' in key_lower:
                         try:
@@ -287,8 +520,8 @@ class OSINTEnhancer:
             
             # Альтернативный поиск
             if lat is None or lon is None:
-                for key, value in metadata.items():
-                    if 'coordinates' in key.lower():
+                for key_lower, (key, value) in index.items():
+                    if 'coordinates' in key_lower:
                         try:
                             coords = str(value).split(',')
                             if len(coords) == 2:
@@ -306,12 +539,20 @@ class OSINTEnhancer:
     
     def _coord_to_3words(self, lat, lon):
         """Простая эмуляция what3words (для демо)"""
-        return f"demo.words.{hashlib.md5(f'{lat}{lon}'.encode()).hexdigest()[:8]}"
+        return f"demo.words.{self._coord_token(lat, lon)}"
+    
+    @staticmethod
+    def _coord_token(lat, lon):
+        """Короткий идентификатор координат (не криптография - хватает CRC32)"""
+        return f"{zlib.crc32(f'{lat}{lon}'.encode()):08x}"
+    
+    def _reverse(self, lat, lon):
+        """Обратное геокодирование через общий кэш"""
+        return _reverse_cached(self.geolocator, round(lat, 4), round(lon, 4))
     
-    def _analyze_location_type(self, lat, lon):
-        """Анализ типа местности по координатам"""
+    def _analyze_location_type(self, location):
+        """Анализ типа местности по уже полученному адресу"""
         try:
-            location = self.geolocator.reverse(f"{lat}, {lon}")
             if location:
                 address = location.raw.get('address', {})
                 
@@ -332,127 +573,480 @@ class OSINTEnhancer:
         except:
             return "Unknown"
     
-    def _extract_lens_info(self, metadata):
+    def _extract_lens_info(self, index):
         """Извлекает информацию об объективе"""
         lens_data = []
         
-        for key, value in metadata.items():
-            if 'lens' in key.lower():
+        for key_lower, (key, value) in index.items():
+            if 'lens' in key_lower:
                 lens_data.append(f"{key}: {value}")
-            elif 'focal' in key.lower() and 'length' in key.lower():
+            elif 'focal' in key_lower and 'length' in key_lower:
                 lens_data.append(f"Focal: {value}")
-            elif 'aperture' in key.lower():
+            elif 'aperture' in key_lower:
                 lens_data.append(f"Aperture: {value}")
                 
         return ' | '.join(lens_data) if lens_data else None
 
+class _Ratio(Fraction):
+    """Дробь, которая печатается как в exifread (617/50, а не Fraction(617, 50))"""
+    __repr__ = Fraction.__str__
+
+# Типы exiv2, которые exifread отдаёт списком чисел (Undefined - списком байтов)
+_EXIV2_NUMERIC_TYPES = frozenset({
+    'Byte', 'SByte', 'Short', 'SShort', 'Long', 'SLong', 'Rational', 'SRational', 'Undefined',
+})
+_EXIV2_NUMBER_RE = re.compile(r'-?\d+(?:/\d+)?')
+
+class _Exiv2Tag:
+    """Значение тега libexiv2 в виде тега exifread (values + printable)"""
+    __slots__ = ('printable', 'values')
+    
+    def __init__(self, printable, type_name='Ascii'):
+        self.printable = printable
+        self.values = printable
+        if type_name not in _EXIV2_NUMERIC_TYPES:
+            # Ascii ("1.10", "0012345") - строка как есть
+            return
+        parts = printable.split()
+        if not parts or not all(_EXIV2_NUMBER_RE.fullmatch(part) for part in parts):
+            return
+        try:
+            # "33/1 52/1 1234/100" -> [33, 52, 617/50], печать как у exifread
+            values = [_Ratio(part) for part in parts]
+        except ZeroDivisionError:
+            return
+        if values:
+            self.values = values
+            self.printable = str(values[0]) if len(values) == 1 else str(values)
+    
+    def __str__(self):
+        return self.printable
+
+# Пробельные символы и NUL-заполнение по краям строк EXIF
+_EXIF_PADDING = '\x00' + string.whitespace
+
+def _exif_bytes_value(value):
+    """Байты EXIF: текст, если это не одни нули и пробелы"""
+    stripped = value.decode('utf-8', errors='ignore').strip(_EXIF_PADDING)
+    return stripped if stripped else f"binary_data_{len(value)}_bytes"
+
+def _exif_sequence_value(value):
+    """Массивы EXIF через '|'"""
+    return '|'.join(str(x) for x in value) if value else None
+
+def _exif_default_value(value):
+    """Ratio, теги exifread и прочие типы"""
+    if hasattr(value, 'values'):
+        # Обработка Ratio и других специальных типов
+        try:
+            return str(value.values)
+        except:
+            return str(value)
+    # Простые типы
+    str_value = str(value).strip()
+    return str_value if str_value else None
+
+# Обработчики по точному типу значения; всё остальное - _exif_default_value
+_EXIF_VALUE_HANDLERS = {
+    type(None): lambda value: None,
+    bytes: _exif_bytes_value,
+    list: _exif_sequence_value,
+    tuple: _exif_sequence_value,
+    int: str,
+    float: str,
+    str: lambda value: value.strip() or None,
+}
+
+class _PiexifTag:
+    """Байтовый тег piexif в виде тега exifread (values - список байт, как у exifread)"""
+    __slots__ = ('printable', 'values')
+    
+    def __init__(self, value):
+        self.values = list(value)
+        self.printable = bytes(value).decode('utf-8', errors='replace').strip('\x00 ')
+    
+    def __str__(self):
+        return self.printable
+
 class UltraMetadataExtractor:
     """УЛЬТРА-экстрактор - вытягивает ВСЁ что возможно из фото"""
     
-    def extract_metadata(self, image_path):
-        """Извлекаем АБСОЛЮТНО ВСЕ метаданные"""
+    def __init__(self, hashes=tuple(FORENSIC_HASHES), create_map=True, bruteforce=False,
+                 cache_results=False):
+        # Какие хеши файла считать в OSINT-режиме (см. FORENSIC_HASHES)
+        self.hashes = hashes
+        # Сохранять ли HTML-карту с местом съёмки (OSINT_Map_File)
+        self.create_map = create_map
+        # Искать XMP/IPTC по всему файлу, а не только в его начале (см. _scan_limit)
+        self.bruteforce = bruteforce
+        # Держать ли последние результаты extract_osint_metadata в памяти: окупается только
+        # при повторных открытиях одного файла (GUI), пакетная обработка видит файл один раз
+        self.cache_results = cache_results
+        # Общий OSINT-усилитель на время пакетной обработки (см. open_batch)
+        self._osint_enhancer = None
+        self._init_result_cache()
+    
+    # Сколько последних результатов extract_osint_metadata держать в памяти
+    _RESULT_CACHE_SIZE = 128
+    
+    def _init_result_cache(self):
+        """LRU результатов: (путь, mtime_ns, размер, makernotes) -> метаданные"""
+        self._result_cache = OrderedDict() if self.cache_results else None
+        # GUI запускает извлечение из пула потоков
+        self._result_cache_lock = threading.Lock()
+    
+    def open_batch(self):
+        """Пакетный режим: один OSINTEnhancer (и геокодер) на все файлы"""
+        if self._osint_enhancer is None:
+            self._osint_enhancer = OSINTEnhancer(self.hashes, self.create_map)
+    
+    def close_batch(self):
+        """Завершение пакетного режима"""
+        self._osint_enhancer = None
+    
+    def __getstate__(self):
+        # Сетевой OSINT-усилитель в дочерние процессы extract_many не передаём
+        state = self.__dict__.copy()
+        state['_osint_enhancer'] = None
+        # Блокировку не сериализовать, а кэш в процессе-получателе не нужен
+        del state['_result_cache'], state['_result_cache_lock']
+        return state
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_result_cache()
+    
+    def extract_many(self, image_paths, max_workers=None):
+        """Параллельное извлечение метаданных для многих файлов (процесс на ядро)"""
+        image_paths = list(image_paths)
+        # В процессы уходят только пути - каждый файл парсится там заново
+        with ProcessPoolExecutor(max_workers=max_workers) as ex:
+            return dict(zip(image_paths, ex.map(self.extract_metadata, image_paths, chunksize=8)))
+    
+    # RAW форматы по расширению
+    _RAW_FORMATS = {
+        '.cr2': 'Canon RAW',
+        '.nef': 'Nikon RAW', 
+        '.arw': 'Sony RAW',
+        '.dng': 'Digital Negative',
+        '.orf': 'Olympus RAW',
+        '.rw2': 'Panasonic RAW'
+    }
+    # Какие разборы имеют смысл для формата: exif - exifread, piexif - только JPEG/TIFF/WebP,
+    # icc, xmp, iptc, raw - шаги 8-10; для остальных шагов сразу пишем "NO"
+    _JPEG_STEPS = ('exif', 'piexif', 'icc', 'xmp', 'iptc')
+    _FORMAT_STEPS = {
+        '.jpg': _JPEG_STEPS,
+        '.jpeg': _JPEG_STEPS,
+        '.jpe': _JPEG_STEPS,
+        '.jfif': _JPEG_STEPS,
+        '.tif': _JPEG_STEPS,
+        '.tiff': _JPEG_STEPS,
+        '.png': ('exif', 'icc', 'xmp'),
+        '.webp': ('exif', 'piexif', 'icc', 'xmp'),
+        '.heic': ('exif', 'icc', 'xmp'),
+        '.heif': ('exif', 'icc', 'xmp'),
+        '.gif': ('xmp',),
+        '.bmp': (),
+        # RAW - TIFF-контейнеры
+        **dict.fromkeys(_RAW_FORMATS, _JPEG_STEPS + ('raw',)),
+    }
+    # Неизвестное расширение: только EXIF, либо все разборы в режиме bruteforce
+    _UNKNOWN_STEPS = ('exif', 'piexif')
+    _BRUTEFORCE_STEPS = _JPEG_STEPS
+    
+    def extract_metadata(self, image_path, include_makernotes=False, stat=None):
+        """Извлекаем АБСОЛЮТНО ВСЕ метаданные (MakerNotes - по запросу, это дорого)"""
         try:
             metadata = {}
             
-            logger.info(f"Начинаем глубокий анализ: {image_path}")
-            
-            # 1. Базовая информация о файле
-            metadata.update(self._get_file_info(image_path))
-            
-            # 2. Глубокий EXIF через exifread
-            metadata.update(self._deep_exifread(image_path))
-            
-            # 3. Расширенный PIL EXIF
-            metadata.update(self._extended_pil_exif(image_path))
-            
-            # 4. Низкоуровневый piexif анализ
-            metadata.update(self._low_level_piexif(image_path))
-            
-            # 5. GPS данные с максимальной детализацией
-            metadata.update(self._detailed_gps(image_path))
+            logger.info("Начинаем глубокий анализ: %s", image_path)
             
-            # 6. MakerNotes от производителей камер
-            metadata.update(self._extract_makernotes(image_path))
+            # Расширение вычисляется один раз на файл
+            ext = os.path.splitext(image_path)[1].lower()
             
-            # 7. Технические характеристики изображения
-            metadata.update(self._image_technical_specs(image_path))
-            
-            # 8. Цветовые профили и метаданные
-            metadata.update(self._color_analysis(image_path))
-            
-            # 9. XMP и IPTC данные если есть
-            metadata.update(self._xmp_iptc_data(image_path))
+            # 1. Базовая информация о файле
+            metadata.update(self._get_file_info(image_path, stat, ext))
             
-            # 10. Специфичные данные для RAW форматов
-            metadata.update(self._raw_specific_data(image_path))
+            # Файл открывается один раз: exifread и PIL читают сам файл, поиск XMP/IPTC - его mmap
+            with open(image_path, 'rb') as stream, _map_fileobj(stream) as data:
+                metadata.update(self._extract_from_data(image_path, stream, data, include_makernotes, ext))
             
-            logger.info(f"Извлечено {len(metadata)} метаданных - РЕКОРД!")
+            logger.info("Извлечено %s метаданных - РЕКОРД!", len(metadata))
             return metadata
             
         except Exception as e:
-            logger.error(f"Критическая ошибка: {e}")
+            logger.error("Критическая ошибка: %s", e)
             return {"Error": f"Extraction failed: {str(e)}"}
     
-    def extract_osint_metadata(self, image_path):
+    def _extract_from_data(self, image_path, stream, data, include_makernotes, ext):
+        """Шаги 2-10 extract_metadata: stream - файл для PIL/exifread, data - его mmap (или b'')"""
+        metadata = {}
+        # mmap.seek за конец файла бросает ValueError (PIL пробует смещение 2048 даже
+        # у маленьких файлов), поэтому PIL и exifread получают обычный файловый объект
+        
+        # Набор разборов выбирается по расширению один раз
+        steps = self._FORMAT_STEPS.get(ext, self._BRUTEFORCE_STEPS if self.bruteforce
+                                       else self._UNKNOWN_STEPS)
+        
+        # Один разбор piexif на шаги 2 (пропущенные exifread теги), 3 и 4
+        exif_dict = self._load_piexif(image_path) if 'piexif' in steps else {}
+        
+        # 2. Глубокий EXIF через exifread (один разбор на шаги 2, 5 и 6)
+        exif_tags = {}
+        if 'exif' in steps:
+            exif_tags = self._read_exif_tags(image_path, stream, include_makernotes, exif_dict)
+        metadata.update(self._deep_exifread(exif_tags))
+        
+        # 3. Расширенный PIL EXIF
+        metadata.update(self._extended_pil_exif(stream, exif_dict))
+        
+        # 4. Низкоуровневый piexif анализ
+        metadata.update(self._low_level_piexif(exif_dict))
+        
+        # 5. GPS данные с максимальной детализацией
+        metadata.update(self._detailed_gps(exif_tags))
+        
+        # 6. MakerNotes от производителей камер
+        if include_makernotes:
+            metadata.update(self._extract_makernotes(exif_tags))
+        
+        # 7. Технические характеристики изображения
+        metadata.update(self._image_technical_specs(stream))
+        
+        # 8. Цветовые профили и метаданные
+        if 'icc' in steps:
+            metadata.update(self._color_analysis(stream))
+        else:
+            metadata["Color_ICC_Present"] = "NO"
+        
+        # 9. XMP и IPTC данные если есть
+        if 'xmp' in steps:
+            metadata.update(self._xmp_data(data, ext))
+        else:
+            metadata['XMP_Present'] = 'NO'
+        if 'iptc' in steps:
+            metadata.update(self._iptc_data(data, ext))
+        else:
+            metadata['IPTC_Present'] = 'NO'
+        
+        # 10. Специфичные данные для RAW форматов
+        if 'raw' in steps:
+            metadata.update(self._raw_specific_data(ext))
+        else:
+            metadata["RAW_File"] = "NO"
+        
+        return metadata
+    
+    def extract_osint_metadata(self, image_path, include_makernotes=False):
         """Извлекает метаданные с OSINT-усилением"""
         try:
+            # Один stat на базовую информацию о файле и криминалистический анализ
+            stat = os.stat(image_path)
+            
+            # Неизменённый файл повторно не разбираем; отдаём копию, чтобы кэш не портили
+            key = (os.path.abspath(image_path), stat.st_mtime_ns, stat.st_size, include_makernotes)
+            if self._result_cache is not None:
+                with self._result_cache_lock:
+                    cached = self._result_cache.get(key)
+                    if cached is not None:
+                        self._result_cache.move_to_end(key)
+                        return dict(cached)
+            
             # Сначала получаем базовые метаданные
-            basic_metadata = self.extract_metadata(image_path)
+            basic_metadata = self.extract_metadata(image_path, include_makernotes, stat)
             
             # Затем усиливаем OSINT-данными
-            osint_enhancer = OSINTEnhancer()
-            enhanced_metadata = osint_enhancer.enhance_metadata(basic_metadata, image_path)
+            osint_enhancer = self._osint_enhancer or OSINTEnhancer(self.hashes, self.create_map)
+            enhanced_metadata = osint_enhancer.enhance_metadata(basic_metadata, image_path, stat)
             
-            logger.info(f"OSINT enhancement added {len(enhanced_metadata) - len(basic_metadata)} additional data points")
+            logger.info("OSINT enhancement added %s additional data points", len(enhanced_metadata) - len(basic_metadata))
+            if self._result_cache is not None:
+                with self._result_cache_lock:
+                    self._result_cache[key] = dict(enhanced_metadata)
+                    if len(self._result_cache) > self._RESULT_CACHE_SIZE:
+                        self._result_cache.popitem(last=False)
             return enhanced_metadata
             
         except Exception as e:
-            logger.error(f"OSINT extraction failed: {e}")
-            return self.extract_metadata(image_path)  # Fallback to basic
+            logger.error("OSINT extraction failed: %s", e)
+            return self.extract_metadata(image_path, include_makernotes)  # Fallback to basic
     
-    def _get_file_info(self, image_path):
+    def _get_file_info(self, image_path, stat=None, ext=None):
         """Базовая информация о файле"""
         info = {}
         try:
-            stat = os.stat(image_path)
+            stat = stat or os.stat(image_path)
             info["File_Path"] = os.path.abspath(image_path)
             info["File_Name"] = os.path.basename(image_path)
             info["File_Size_Bytes"] = stat.st_size
             info["File_Size_MB"] = f"{stat.st_size / (1024*1024):.2f}"
-            info["File_Created"] = datetime.fromtimestamp(stat.st_ctime).isoformat()
-            info["File_Modified"] = datetime.fromtimestamp(stat.st_mtime).isoformat()
-            info["File_Extension"] = os.path.splitext(image_path)[1].lower()
+            info["File_Created"] = _iso_timestamp(stat.st_ctime)
+            info["File_Modified"] = _iso_timestamp(stat.st_mtime)
+            info["File_Extension"] = ext if ext is not None else os.path.splitext(image_path)[1].lower()
         except Exception as e:
-            logger.warning(f"File info error: {e}")
+            logger.warning("File info error: %s", e)
         return info
     
-    def _deep_exifread(self, image_path):
+    # Группы exiv2 -> префиксы IFD в именах тегов exifread
+    _EXIV2_IFD_NAMES = {
+        'Image': 'Image',
+        'Photo': 'EXIF',
+        'GPSInfo': 'GPS',
+        'Thumbnail': 'Thumbnail',
+        'Iop': 'Interoperability',
+    }
+    # Теги, которые exiv2 и exifread называют по-разному
+    _EXIV2_TAG_ALIASES = {
+        'ExifTag': 'ExifOffset',
+        'GPSTag': 'GPSInfo',
+        'InteroperabilityTag': 'InteroperabilityOffset',
+        'XMLPacket': 'ApplicationNotes',
+    }
+    # Префикс кодировки, который exiv2 дописывает к UserComment
+    _EXIV2_CHARSET_RE = re.compile(r'\Acharset=("[^"]*"|\S+)\s?')
+    
+    def _read_exif_tags(self, image_path, stream, details=False, exif_dict=None):
+        """Единственный разбор EXIF - теги нужны сразу трём анализам (exif_dict - разбор piexif)"""
+        if pyexiv2 is not None:
+            try:
+                return self._read_exiv2_tags(image_path, details, exif_dict)
+            except Exception as e:
+                # Например, битый XMP-пакет - exifread такое переживает
+                logger.debug("pyexiv2: %s", e)
+        try:
+            stream.seek(0)
+            # details (MakerNotes и SubIFD) в разы замедляет разбор - только по запросу;
+            # миниатюры всё равно отбрасываются, поэтому их не извлекаем.
+            # Без details exifread пропускает ещё UserComment и XMLPacket - их берём из piexif
+            tags = exifread.process_file(stream, details=details, strict=False, debug=False,
+                                         extract_thumbnail=False)
+            if not details and exif_dict:
+                self._restore_skipped_tags(tags, exif_dict)
+            return tags
+        except Exception as e:
+            logger.warning("Exifread: %s", e)
+            return {}
+    
+    # Теги, которые exifread без details не читает вместе с MakerNote:
+    # IFD piexif, номер тега -> имя тега exifread
+    _EXIFREAD_SKIPPED_TAGS = (
+        ("0th", piexif.ImageIFD.XMLPacket, "Image ApplicationNotes"),
+        ("Exif", piexif.ExifIFD.UserComment, "EXIF UserComment"),
+    )
+    
+    # Теги, которые libexiv2 отдаёт уже раскодированными (charset=..., UCS-2):
+    # сырые байты берём из piexif, как их показывает exifread
+    _EXIV2_DECODED_TAGS = (
+        ("Exif", piexif.ExifIFD.UserComment, "EXIF UserComment"),
+        ("0th", piexif.ImageIFD.XPTitle, "Image XPTitle"),
+        ("0th", piexif.ImageIFD.XPComment, "Image XPComment"),
+        ("0th", piexif.ImageIFD.XPAuthor, "Image XPAuthor"),
+        ("0th", piexif.ImageIFD.XPKeywords, "Image XPKeywords"),
+        ("0th", piexif.ImageIFD.XPSubject, "Image XPSubject"),
+    )
+    
+    def _restore_skipped_tags(self, exif_tags, exif_dict, skipped=_EXIFREAD_SKIPPED_TAGS, replace=False):
+        """Дополняет теги exifread (details=False) UserComment и XMLPacket из разбора piexif"""
+        for ifd_name, tag_id, name in skipped:
+            value = exif_dict.get(ifd_name, {}).get(tag_id)
+            if value and (replace or name not in exif_tags):
+                exif_tags[name] = _PiexifTag(value)
+    
+    def _read_exiv2_tags(self, image_path, details=False, exif_dict=None):
+        """Разбор EXIF через libexiv2 с именами тегов как у exifread"""
+        with pyexiv2.Image(image_path) as img:
+            raw = img.read_exif_detail()
+        tags = {}
+        for key, detail in raw.items():
+            value = detail['value']
+            _, group, name = key.split('.', 2)
+            ifd = self._EXIV2_IFD_NAMES.get(group)
+            if ifd is None:
+                # Группы производителей (Canon, Nikon3...) и SubImage - только с details
+                if not details:
+                    continue
+                ifd = group if group.startswith('SubImage') else f"MakerNote {group}"
+            if isinstance(value, list):
+                value = ' '.join(value)
+            if name == 'UserComment':
+                value = self._EXIV2_CHARSET_RE.sub('', value, count=1)
+            name = self._EXIV2_TAG_ALIASES.get(name, name)
+            tags[f"{ifd} {name}"] = _Exiv2Tag(value, detail.get('typeName'))
+        if exif_dict:
+            self._restore_skipped_tags(tags, exif_dict, self._EXIV2_DECODED_TAGS, replace=True)
+        return tags
+    
+    def _deep_exifread(self, tags):
         """СУПЕР-глубокий анализ через exifread"""
         metadata = {}
         try:
-            with open(image_path, 'rb') as f:
-                # Включаем ВСЕ возможные детали
-                tags = exifread.process_file(f, details=True, strict=True, debug=True)
+            for tag, value in tags.items():
+                # Пропускаем только бинарные миниатюры
+                if tag in ['JPEGThumbnail', 'TIFFThumbnail']:
+                    continue
                 
-                for tag, value in tags.items():
-                    # Пропускаем только бинарные миниатюры
-                    if tag in ['JPEGThumbnail', 'TIFFThumbnail']:
-                        continue
-                    
-                    # Обрабатываем разные типы данных
-                    processed_value = self._process_exif_value(value)
-                    if processed_value and str(processed_value).strip():
-                        metadata[f"EXIFDEEP_{tag}"] = processed_value
+                # Обрабатываем разные типы данных
+                processed_value = self._process_exif_value(value)
+                if processed_value and str(processed_value).strip():
+                    metadata[f"EXIFDEEP_{tag}"] = processed_value
                         
         except Exception as e:
-            logger.warning(f"Deep exifread: {e}")
+            logger.warning("Deep exifread: %s", e)
         return metadata
     
-    def _extended_pil_exif(self, image_path):
+    def _load_piexif(self, image_path):
+        """Единственный разбор EXIF через piexif - его используют PILEXIF_* и PIEXIF_*"""
+        try:
+            return piexif.load(image_path)
+        except Exception as e:
+            logger.warning("Low level piexif: %s", e)
+            return {}
+    
+    # IFD piexif, которые PIL сводит в один словарь _getexif()
+    _PIL_EXIF_IFDS = ("0th", "Exif")
+    _PIL_RATIONAL_TYPES = (piexif.TYPES.Rational, piexif.TYPES.SRational)
+    
+    def _pil_style_exif(self, exif_dict):
+        """Теги piexif в виде img._getexif(): tag_id -> значение как у PIL"""
+        exif_data = {}
+        for ifd_name in self._PIL_EXIF_IFDS:
+            for tag_id, value in exif_dict.get(ifd_name, {}).items():
+                tag_type = piexif.TAGS[ifd_name].get(tag_id, {}).get('type')
+                if tag_type in self._PIL_RATIONAL_TYPES:
+                    # (num, den) -> IFDRational, ((n, d), ...) -> кортеж IFDRational
+                    if value and isinstance(value[0], tuple):
+                        value = tuple(IFDRational(*v) for v in value)
+                    else:
+                        value = IFDRational(*value)
+                elif isinstance(value, bytes) and tag_type == piexif.TYPES.Ascii:
+                    value = value.rstrip(b'\x00').decode('utf-8', errors='replace')
+                elif isinstance(value, tuple) and tag_type == piexif.TYPES.Byte:
+                    # PIL отдаёт BYTE-массивы (например XMLPacket) как bytes
+                    value = bytes(value)
+                exif_data[tag_id] = value
+        # PIL подставляет вместо указателя на GPS IFD сам словарь GPS тегов
+        if exif_dict.get("GPS") and piexif.ImageIFD.GPSTag in exif_data:
+            exif_data[piexif.ImageIFD.GPSTag] = exif_dict["GPS"]
+        return exif_data
+    
+    def _pil_getexif(self, img):
+        """EXIF от PIL в виде img._getexif(): IFD0 + Exif IFD, GPSInfo - словарь GPS тегов"""
+        exif = img.getexif()
+        if not exif:
+            return {}
+        exif_data = dict(exif)
+        exif_data.update(exif.get_ifd(ExifTags.IFD.Exif))
+        gps = exif.get_ifd(ExifTags.IFD.GPSInfo)
+        if gps:
+            exif_data[ExifTags.IFD.GPSInfo] = gps
+        return exif_data
+    
+    def _extended_pil_exif(self, stream, exif_dict):
         """Расширенный EXIF через PIL"""
         metadata = {}
         try:
-            with Image.open(image_path) as img:
+            with Image.open(stream) as img:
                 # Вся основная информация
                 metadata["PIL_Format"] = str(img.format)
                 metadata["PIL_Mode"] = str(img.mode)
@@ -461,8 +1055,9 @@ class UltraMetadataExtractor:
                 metadata["PIL_Height"] = img.height
                 metadata["PIL_Bands"] = str(img.getbands())
                 
-                # ВСЕ EXIF данные
-                exif_data = img._getexif()
+                # ВСЕ EXIF данные - из уже разобранного piexif, без повторного _getexif();
+                # piexif не читает PNG (eXIf) и др. - тогда берём EXIF у самого PIL
+                exif_data = self._pil_style_exif(exif_dict) or self._pil_getexif(img)
                 if exif_data:
                     for tag_id, value in exif_data.items():
                         tag_name = ExifTags.TAGS.get(tag_id, tag_id)
@@ -482,15 +1077,13 @@ class UltraMetadataExtractor:
                             metadata[f"PILINFO_{key}"] = str(value)
                             
         except Exception as e:
-            logger.warning(f"Extended PIL: {e}")
+            logger.warning("Extended PIL: %s", e)
         return metadata
     
-    def _low_level_piexif(self, image_path):
+    def _low_level_piexif(self, exif_dict):
         """Низкоуровневый анализ через piexif"""
         metadata = {}
         try:
-            exif_dict = piexif.load(image_path)
-            
             # Анализируем ВСЕ IFD секции
             for ifd_name in ("0th", "Exif", "GPS", "1st", "Interop"):
                 if ifd_name in exif_dict:
@@ -511,16 +1104,13 @@ class UltraMetadataExtractor:
                             metadata[f"PIEXIF_ERROR_{ifd_name}_{tag}"] = f"Tag error: {e}"
                             
         except Exception as e:
-            logger.warning(f"Low level piexif: {e}")
+            logger.warning("Low level piexif: %s", e)
         return metadata
     
-    def _detailed_gps(self, image_path):
+    def _detailed_gps(self, tags):
         """Детальный GPS анализ"""
         metadata = {}
         try:
-            with open(image_path, 'rb') as f:
-                tags = exifread.process_file(f)
-            
             # Собираем ВСЕ GPS теги
             gps_data = {}
             for tag, value in tags.items():
@@ -580,16 +1170,13 @@ class UltraMetadataExtractor:
                         metadata[f"GPS_{friendly_name}"] = str(gps_data[gps_tag])
                     
         except Exception as e:
-            logger.warning(f"Detailed GPS: {e}")
+            logger.warning("Detailed GPS: %s", e)
         return metadata
     
-    def _extract_makernotes(self, image_path):
+    def _extract_makernotes(self, tags):
         """Извлечение MakerNotes - данных производителей"""
         metadata = {}
         try:
-            with open(image_path, 'rb') as f:
-                tags = exifread.process_file(f, details=True)
-            
             # Ищем MakerNotes
             maker_tags = {}
             for tag, value in tags.items():
@@ -608,14 +1195,14 @@ class UltraMetadataExtractor:
                 metadata["MakerNotes_Present"] = "NO"
                 
         except Exception as e:
-            logger.warning(f"MakerNotes: {e}")
+            logger.warning("MakerNotes: %s", e)
         return metadata
     
-    def _image_technical_specs(self, image_path):
+    def _image_technical_specs(self, stream):
         """Технические характеристики изображения"""
         metadata = {}
         try:
-            with Image.open(image_path) as img:
+            with Image.open(stream) as img:
                 # Различные технические параметры
                 metadata["Technical_Format"] = img.format
                 metadata["Technical_Mode"] = img.mode
@@ -644,14 +1231,14 @@ class UltraMetadataExtractor:
                     pass
                     
         except Exception as e:
-            logger.warning(f"Technical specs: {e}")
+            logger.warning("Technical specs: %s", e)
         return metadata
     
-    def _color_analysis(self, image_path):
+    def _color_analysis(self, stream):
         """Анализ цветовых профилей"""
         metadata = {}
         try:
-            with Image.open(image_path) as img:
+            with Image.open(stream) as img:
                 # ICC профиль
                 if 'icc_profile' in img.info:
                     icc_data = img.info['icc_profile']
@@ -659,6 +1246,7 @@ class UltraMetadataExtractor:
                     metadata["Color_ICC_Size_Bytes"] = len(icc_data)
                     
                     try:
+                        from PIL import ImageCms
                         icc_profile = ImageCms.ImageCmsProfile(io.BytesIO(icc_data))
                         metadata["Color_ICC_Description"] = ImageCms.getProfileDescription(icc_profile)
                         metadata["Color_ICC_Manufacturer"] = ImageCms.getProfileManufacturer(icc_profile)
@@ -670,29 +1258,138 @@ class UltraMetadataExtractor:
                     metadata["Color_ICC_Present"] = "NO"
                     
         except Exception as e:
-            logger.warning(f"Color analysis: {e}")
+            logger.warning("Color analysis: %s", e)
         return metadata
     
-    def _xmp_iptc_data(self, image_path):
-        """XMP и IPTC данные"""
+    # Маркеры JPEG без поля длины: TEM, RST0-RST7, SOI, EOI
+    _JPEG_STANDALONE_MARKERS = frozenset([0x01, 0xD8, 0xD9, *range(0xD0, 0xD8)])
+    _XMP_APP1_HEADER = b'http://ns.adobe.com/xap/1.0/\x00'
+    _IPTC_APP13_HEADER = b'Photoshop 3.0\x00'
+    _PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+    
+    def _jpeg_app_payloads(self, f, app_code, header):
+        """Данные сегментов APPn JPEG с заданным заголовком - данные изображения не читаются"""
+        packets = []
+        f.seek(2)
+        while True:
+            marker = f.read(2)
+            if len(marker) < 2 or marker[0] != 0xFF:
+                break
+            code = marker[1]
+            while code == 0xFF:  # байты-заполнители между сегментами
+                byte = f.read(1)
+                if not byte:
+                    return packets
+                code = byte[0]
+            if code in self._JPEG_STANDALONE_MARKERS:
+                continue
+            if code == 0xDA:  # SOS - дальше только сжатые данные
+                break
+            length = f.read(2)
+            if len(length) < 2:
+                break
+            size = int.from_bytes(length, 'big') - 2
+            if code == app_code:
+                payload = f.read(size)
+                if payload.startswith(header):
+                    packets.append(payload[len(header):])
+            else:
+                try:
+                    f.seek(size, 1)
+                except ValueError:  # mmap не даёт встать за конец обрезанного файла
+                    break
+        return packets
+    
+    def _png_xmp_chunks(self, f):
+        """XMP-пакеты из iTXt-чанков PNG (XML:com.adobe.xmp), остальное пропускается"""
+        packets = []
+        f.seek(len(self._PNG_SIGNATURE))
+        end = len(f)
+        while True:
+            pos = f.tell()
+            header = f.read(8)
+            if len(header) < 8:
+                break
+            size = int.from_bytes(header[:4], 'big')
+            # Обрезанный файл: длина чанка уходит за конец (mmap.seek бросил бы ValueError)
+            if pos + size + 12 > end:
+                break
+            chunk_type = header[4:]
+            if chunk_type == b'IEND':
+                break
+            if chunk_type != b'iTXt':
+                f.seek(size + 4, 1)  # данные + CRC
+                continue
+            data = f.read(size)
+            f.seek(4, 1)
+            keyword, _, rest = data.partition(b'\x00')
+            if keyword != b'XML:com.adobe.xmp' or len(rest) < 2:
+                continue
+            compressed = rest[0]
+            # язык и переведённое ключевое слово нам не нужны
+            text = rest[2:].split(b'\x00', 2)[-1]
+            try:
+                packets.append(zlib.decompress(text) if compressed else text)
+            except zlib.error:
+                continue  # битый сжатый пакет - остальные чанки ещё могут пригодиться
+        return packets
+    
+    # Сколько байт от начала файла просматривать в поиске XMP/IPTC: в JPEG они
+    # в APP-сегментах у самого начала, в RAW - за IFD и превью
+    _SCAN_WINDOW = 128 * 1024
+    _RAW_SCAN_WINDOW = 512 * 1024
+    # Предел размера XMP-пакета при поиске закрывающего тега
+    _XMP_MAX_SIZE = 1024 * 1024
+    # Признаки IPTC вне JPEG: один проход регулярным выражением вместо трёх find
+    _IPTC_MARKERS_RE = re.compile(rb'Photoshop 3\.0|IPTC|8BIM')
+    
+    def _scan_limit(self, raw, ext):
+        """Граница поиска маркеров XMP/IPTC в файле (весь файл при bruteforce)"""
+        if self.bruteforce:
+            return len(raw)
+        window = self._RAW_SCAN_WINDOW if ext in self._RAW_FORMATS else self._SCAN_WINDOW
+        return min(window, len(raw))
+    
+    def _xmp_data(self, raw, ext):
+        """XMP данные"""
         metadata = {}
         try:
-            # Pillow не всегда раскрывает XMP/IPTC; поэтому читаем сырые байты
-            with open(image_path, 'rb') as f:
-                raw = f.read()
+            # Pillow не всегда раскрывает XMP/IPTC; поэтому ищем по сырым байтам (mmap файла)
+            # В JPEG и PNG XMP лежит в известных сегментах - идём по структуре файла
+            signature = raw[:len(self._PNG_SIGNATURE)]
+            if signature.startswith(b'\xff\xd8'):
+                xmp_source = b''.join(self._jpeg_app_payloads(raw, 0xE1, self._XMP_APP1_HEADER))
+                xmp_limit = len(xmp_source)
+            elif signature == self._PNG_SIGNATURE:
+                xmp_source = b''.join(self._png_xmp_chunks(raw))
+                xmp_limit = len(xmp_source)
+            else:
+                # Неизвестный формат - ищем XMP в начале файла (или по всему при bruteforce)
+                xmp_source = raw
+                xmp_limit = self._scan_limit(raw, ext)
 
             # Поиск XMP блока
-            xmp_start = raw.find(b'<x:xmpmeta')
+            # Явный start=0: mmap.find по умолчанию ищет от текущей позиции
+            xmp_start = xmp_source.find(b'<x:xmpmeta', 0, xmp_limit)
             if xmp_start == -1:
-                xmp_start = raw.find(b'<xpacket')
+                xmp_start = xmp_source.find(b'<?xpacket', 0, xmp_limit)
 
             if xmp_start != -1:
                 # Попробуем извлечь до совпадения закрывающего тега или ограничим размер
-                end_tag = raw.find(b'</x:xmpmeta>', xmp_start)
-                if end_tag == -1:
-                    end_tag = raw.find(b'</xpacket>', xmp_start)
-                end_index = end_tag + 12 if end_tag != -1 else xmp_start + 20000
-                xmp_raw = raw[xmp_start:end_index]
+                # Конец пакета ищем не дальше разумного размера XMP, а не до конца файла
+                end_limit = min(len(xmp_source), xmp_start + self._XMP_MAX_SIZE)
+                end_index = xmp_start + 20000
+                end_tag = xmp_source.find(b'</x:xmpmeta>', xmp_start, end_limit)
+                if end_tag != -1:
+                    end_index = end_tag + len(b'</x:xmpmeta>')
+                else:
+                    # Без x:xmpmeta пакет закрывается инструкцией <?xpacket end="w"?>
+                    end_tag = xmp_source.find(b'<?xpacket end', xmp_start, end_limit)
+                    if end_tag != -1:
+                        end_tag = xmp_source.find(b'?>', end_tag, end_limit)
+                    if end_tag != -1:
+                        end_index = end_tag + len(b'?>')
+                xmp_raw = xmp_source[xmp_start:end_index]
                 try:
                     metadata['XMP_Raw'] = xmp_raw.decode('utf-8', errors='ignore')
                     metadata['XMP_Present'] = 'YES'
@@ -701,9 +1398,23 @@ class UltraMetadataExtractor:
                     metadata['XMP_Present'] = 'YES'
             else:
                 metadata['XMP_Present'] = 'NO'
-
-            # Поиск IPTC (Photoshop IRB / IPTC headers)
-            if b'Photoshop 3.0' in raw or b'IPTC' in raw or b'8BIM' in raw:
+                        
+        except Exception as e:
+            logger.warning("XMP: %s", e)
+        return metadata
+    
+    def _iptc_data(self, raw, ext):
+        """IPTC данные"""
+        metadata = {}
+        try:
+            # В JPEG IPTC лежит в APP13 (Photoshop IRB) - идём по сегментам до SOS
+            if raw[:2] == b'\xff\xd8':
+                present = bool(self._jpeg_app_payloads(raw, 0xED, self._IPTC_APP13_HEADER))
+            else:
+                limit = self._scan_limit(raw, ext)
+                # Поиск IPTC (Photoshop IRB / IPTC headers); re работает и с mmap
+                present = self._IPTC_MARKERS_RE.search(raw, 0, limit) is not None
+            if present:
                 metadata['IPTC_Present'] = 'YES'
                 # Не парсим все IPTC, просто извлекаем небольшие фрагменты для анализа
                 sample = raw[:4000]
@@ -715,26 +1426,16 @@ class UltraMetadataExtractor:
                 metadata['IPTC_Present'] = 'NO'
                         
         except Exception as e:
-            logger.warning(f"XMP IPTC: {e}")
+            logger.warning("IPTC: %s", e)
         return metadata
     
-    def _raw_specific_data(self, image_path):
-        """Данные специфичные для RAW форматов"""
+    def _raw_specific_data(self, file_ext):
+        """Данные специфичные для RAW форматов (file_ext - расширение в нижнем регистре)"""
         metadata = {}
-        file_ext = os.path.splitext(image_path)[1].lower()
         
         # Определяем RAW формат
-        raw_formats = {
-            '.cr2': 'Canon RAW',
-            '.nef': 'Nikon RAW', 
-            '.arw': 'Sony RAW',
-            '.dng': 'Digital Negative',
-            '.orf': 'Olympus RAW',
-            '.rw2': 'Panasonic RAW'
-        }
-        
-        if file_ext in raw_formats:
-            metadata["RAW_Format"] = raw_formats[file_ext]
+        if file_ext in self._RAW_FORMATS:
+            metadata["RAW_Format"] = self._RAW_FORMATS[file_ext]
             metadata["RAW_File"] = "YES"
         else:
             metadata["RAW_File"] = "NO"
@@ -744,54 +1445,21 @@ class UltraMetadataExtractor:
     def _process_exif_value(self, value):
         """Умная обработка значений EXIF"""
         try:
-            if value is None:
-                return None
-                
-            if isinstance(value, bytes):
-                try:
-                    # Пробуем декодировать
-                    decoded = value.decode('utf-8', errors='ignore').strip()
-                    if decoded and not all(c in ['\x00', ' '] for c in decoded):
-                        return decoded
-                    else:
-                        return f"binary_data_{len(value)}_bytes"
-                except:
-                    return f"binary_data_{len(value)}_bytes"
-                    
-            elif hasattr(value, 'values'):
-                # Обработка Ratio и других специальных типов
-                try:
-                    return str(value.values)
-                except:
-                    return str(value)
-                    
-            elif isinstance(value, (list, tuple)):
-                # Обработка массивов
-                if len(value) > 0:
-                    return '|'.join(str(x) for x in value)
-                else:
-                    return None
-                    
-            else:
-                # Простые типы
-                str_value = str(value).strip()
-                return str_value if str_value else None
-                
+            return _EXIF_VALUE_HANDLERS.get(type(value), _exif_default_value)(value)
         except Exception as e:
             return f"value_error_{str(e)}"
     
     def _convert_gps_coord(self, values):
         """Конвертация GPS координат в десятичные"""
         try:
-            if len(values) >= 3:
-                d = float(values[0])
-                m = float(values[1])
-                s = float(values[2])
-                return d + (m / 60.0) + (s / 3600.0)
-            elif len(values) == 2:
-                return float(values[0]) + (float(values[1]) / 60.0)
-            elif len(values) == 1:
-                return float(values[0])
+            parts = values[:3]
+            if len(parts) == 3:
+                d, m, s = parts
+                return _ratio_value(d) + _ratio_value(m) * _DEG_PER_MINUTE + _ratio_value(s) * _DEG_PER_SECOND
+            elif len(parts) == 2:
+                return _ratio_value(parts[0]) + _ratio_value(parts[1]) * _DEG_PER_MINUTE
+            elif len(parts) == 1:
+                return _ratio_value(parts[0])
             else:
                 return 0.0
         except:
@@ -805,11 +1473,11 @@ class UltraMetadataExtractor:
                 direction = 'S' if is_lat else 'W'
                 decimal = abs(decimal)
                 
-            degrees = int(decimal)
-            minutes_decimal = (decimal - degrees) * 60
-            minutes = int(minutes_decimal)
-            seconds = (minutes_decimal - minutes) * 60
+            # modf делит на дробную и целую части одним вызовом
+            fraction, degrees = math.modf(decimal)
+            fraction, minutes = math.modf(fraction * 60.0)
+            seconds = fraction * 60.0
             
-            return f"{degrees}° {minutes}' {seconds:.2f}\" {direction}"
+            return "%d° %d' %.2f\" %s" % (degrees, minutes, seconds, direction)
         except:
             return "Conversion error"
\ No newline at end of file
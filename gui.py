@@ -1,6 +1,7 @@
 import os
+import re
+import functools
 import json
-import webbrowser
 from datetime import datetime
 from PyQt6.QtWidgets import (
     QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, QSplitter,
@@ -8,12 +9,43 @@ from PyQt6.QtWidgets import (
     QFileDialog, QMessageBox, QHeaderView, QScrollArea, QMenu,
     QApplication
 )
-from PyQt6.QtCore import Qt, QSize, QObject, pyqtSignal, QThread
-from PyQt6.QtGui import QAction, QPixmap, QFont, QColor
+from PyQt6.QtCore import Qt, QSize, QObject, QUrl, pyqtSignal, QRunnable, QThreadPool
+from PyQt6.QtGui import QAction, QPixmap, QImage, QFont, QColor, QImageReader, QDesktopServices
 import logging
 
+try:
+    import orjson  # необязательно: быстрая сериализация экспорта
+except ImportError:
+    orjson = None
+
 logger = logging.getLogger(__name__)
 
+class DecodeSignals(QObject):
+    """Сигналы задачи декодирования: путь и готовое уменьшенное изображение"""
+    done = pyqtSignal(str, QImage)
+
+
+class DecodeTask(QRunnable):
+    """Декодирование превью в пуле потоков (QImage, в отличие от QPixmap, можно вне GUI-потока)"""
+    def __init__(self, path, signals):
+        super().__init__()
+        self.path = path
+        self.signals = signals
+
+    def run(self):
+        reader = QImageReader(self.path)
+        # Декодируем сразу в целевой размер, не создавая полноразмерный буфер
+        size = reader.size()
+        if size.isValid():
+            reader.setScaledSize(size.scaled(350, 350, Qt.AspectRatioMode.KeepAspectRatio))
+        image = reader.read()
+        if not image.isNull() and not size.isValid():
+            # Адаптивное масштабирование
+            image = image.scaled(350, 350, Qt.AspectRatioMode.KeepAspectRatio,
+                                 Qt.TransformationMode.SmoothTransformation)
+        self.signals.done.emit(self.path, image)
+
+
 class ImageViewer(QLabel):
     """Компактный просмотрщик изображений"""
     def __init__(self):
@@ -31,21 +63,89 @@ class ImageViewer(QLabel):
                 padding: 10px;
             }
         """)
+        # Последнее отображённое изображение: (путь, масштабированный QPixmap)
+        self._cache = (None, None)
+        # Путь, превью которого ждём; результаты для других путей устарели
+        self._pending = None
+        self._signals = DecodeSignals()
+        self._signals.done.connect(self._on_decoded)
     
     def load_image(self, path):
+        # Повторное открытие того же файла не декодирует его заново
+        if self._cache[0] == path:
+            self._pending = None
+            self.setPixmap(self._cache[1])
+            self.setText("")
+            return
+        self._pending = path
+        QThreadPool.globalInstance().start(DecodeTask(path, self._signals))
+    
+    def _on_decoded(self, path, image):
+        """Готовое превью из пула потоков"""
+        if path != self._pending:
+            return
+        self._pending = None
         try:
-            pixmap = QPixmap(path)
-            if not pixmap.isNull():
-                # Адаптивное масштабирование
-                scaled = pixmap.scaled(350, 350, Qt.AspectRatioMode.KeepAspectRatio, 
-                                     Qt.TransformationMode.SmoothTransformation)
+            if not image.isNull():
+                scaled = QPixmap.fromImage(image)
+                self._cache = (path, scaled)
                 self.setPixmap(scaled)
                 self.setText("")
         except Exception as e:
             self.setText(f"Load Error: {e}")
+    
+    def clear(self):
+        # Не даём запоздавшему превью появиться после очистки
+        self._pending = None
+        super().clear()
+
 
 class MetadataTree(QTreeWidget):
     """Оптимизированное дерево метаданных"""
+    # Порядок категорий в дереве
+    _CATEGORY_ORDER = (
+        "File Information", "Camera & Lens", "Capture Settings", "GPS & Location",
+        "Date & Time", "Image Properties", "Color & Profiles", "EXIF Data",
+        "RAW Information", "OSINT Intelligence", "Other Metadata",
+    )
+
+    # Правила группировки в порядке приоритета: одна скомпилированная альтернатива на категорию
+    _CATEGORY_RULES = tuple(
+        (category, re.compile('|'.join(map(re.escape, words))))
+        for category, words in (
+            ("File Information", ('file_', 'name', 'size', 'path', 'extension')),
+            ("Camera & Lens", ('make', 'model', 'lens', 'serial', 'camera', 'manufacturer')),
+            ("Capture Settings", ('exposure', 'aperture', 'iso', 'focal', 'shutter', 'white', 'flash', 'metering')),
+            ("GPS & Location", ('gps',)),
+            ("Date & Time", ('date', 'time')),
+            ("Image Properties", ('width', 'height', 'mode', 'format', 'size', 'technical', 'image_')),
+            ("Color & Profiles", ('color', 'icc', 'profile')),
+            ("RAW Information", ('raw',)),
+            ("OSINT Intelligence", ('osint',)),
+            ("EXIF Data", ('exif',)),
+        )
+    )
+
+    # Цвета категорий создаются один раз на класс
+    _CATEGORY_COLORS = {
+        "File Information": QColor(60, 60, 60),
+        "Camera & Lens": QColor(45, 85, 155),
+        "Capture Settings": QColor(35, 110, 75),
+        "GPS & Location": QColor(180, 130, 40),
+        "Date & Time": QColor(150, 75, 180),
+        "Image Properties": QColor(55, 115, 165),
+        "Color & Profiles": QColor(65, 170, 170),
+        "EXIF Data": QColor(200, 100, 100),
+        "RAW Information": QColor(220, 140, 50),
+        "OSINT Intelligence": QColor(255, 165, 0),  # Оранжевый для OSINT
+        "Other Metadata": QColor(100, 100, 100)
+    }
+    _DEFAULT_COLOR = QColor(80, 80, 80)
+    _OSINT_COLOR = QColor(255, 215, 0)  # Золотой для OSINT
+
+    # QFont требует QApplication, поэтому создаётся при первом заполнении
+    _category_font = None
+
     def __init__(self):
         super().__init__()
         self.setHeaderLabels(["Property", "Value"])
@@ -92,93 +192,88 @@ class MetadataTree(QTreeWidget):
         # Контекстное меню
         self.setContextMenuPolicy(Qt.ContextMenuPolicy.CustomContextMenu)
         self.customContextMenuRequested.connect(self._context_menu)
+        
+        # Подсказки выставляются лениво при наведении, а не при заполнении
+        self.setMouseTracking(True)
+        self.itemEntered.connect(self._set_tooltip)
     
     def show_metadata(self, metadata):
         """Оптимизированное отображение метаданных"""
+        # Заполняем дерево одним пакетом без промежуточных перерисовок
+        sorting = self.isSortingEnabled()
+        self.setSortingEnabled(False)
+        self.setUpdatesEnabled(False)
+        try:
+            self._populate(metadata)
+        finally:
+            self.setSortingEnabled(sorting)
+            self.setUpdatesEnabled(True)
+    
+    def _populate(self, metadata):
+        """Построение элементов дерева"""
         self.clear()
         
         if not metadata:
-            no_data_item = QTreeWidgetItem(self, ["No metadata", "Image contains no metadata"])
+            self.addTopLevelItem(QTreeWidgetItem(["No metadata", "Image contains no metadata"]))
             return
             
         # Оптимизированная группировка
-        categories = {
-            "File Information": {},
-            "Camera & Lens": {},
-            "Capture Settings": {},
-            "GPS & Location": {},
-            "Date & Time": {},
-            "Image Properties": {},
-            "Color & Profiles": {},
-            "EXIF Data": {},
-            "RAW Information": {},
-            "OSINT Intelligence": {},
-            "Other Metadata": {}
-        }
+        categories = {name: {} for name in self._CATEGORY_ORDER}
         
         # Быстрая группировка
         for key, value in metadata.items():
-            key_lower = key.lower()
-            
-            if any(x in key_lower for x in ['file_', 'name', 'size', 'path', 'extension']):
-                categories["File Information"][key] = value
-            elif any(x in key_lower for x in ['make', 'model', 'lens', 'serial', 'camera', 'manufacturer']):
-                categories["Camera & Lens"][key] = value
-            elif any(x in key_lower for x in ['exposure', 'aperture', 'iso', 'focal', 'shutter', 'white', 'flash', 'metering']):
-                categories["Capture Settings"][key] = value
-            elif 'gps' in key_lower:
-                categories["GPS & Location"][key] = value
-            elif any(x in key_lower for x in ['date', 'time']):
-                categories["Date & Time"][key] = value
-            elif any(x in key_lower for x in ['width', 'height', 'mode', 'format', 'size', 'technical', 'image_']):
-                categories["Image Properties"][key] = value
-            elif any(x in key_lower for x in ['color', 'icc', 'profile']):
-                categories["Color & Profiles"][key] = value
-            elif 'raw' in key_lower:
-                categories["RAW Information"][key] = value
-            elif 'osint' in key_lower:
-                categories["OSINT Intelligence"][key] = value
-            elif 'exif' in key_lower:
-                categories["EXIF Data"][key] = value
-            else:
-                categories["Other Metadata"][key] = value
+            categories[self._categorize(key.lower())][key] = value
         
         # Эффективное создание дерева
+        top_items = []
         for category_name, items in categories.items():
             if items:
-                category_item = QTreeWidgetItem(self, [category_name, f"{len(items)}"])
-                category_item.setExpanded(True)
+                category_item = QTreeWidgetItem([category_name, f"{len(items)}"])
                 
                 # Стиль категории
-                category_font = QFont("Segoe UI", 9, QFont.Weight.Bold)
-                category_item.setFont(0, category_font)
+                category_item.setFont(0, self._get_category_font())
                 category_item.setBackground(0, self._get_category_color(category_name))
                 
                 # Быстрое добавление элементов
+                children = []
                 for key, value in items.items():
-                    item = QTreeWidgetItem(category_item, [key, str(value)])
-                    item.setToolTip(1, str(value))
+                    item = QTreeWidgetItem([key, str(value)])
                     
                     # Подсветка OSINT данных
                     if 'OSINT' in key:
-                        item.setForeground(0, QColor(255, 215, 0))  # Золотой для OSINT
+                        item.setForeground(0, self._OSINT_COLOR)
+                    children.append(item)
+                category_item.addChildren(children)
+                top_items.append(category_item)
+        
+        self.addTopLevelItems(top_items)
+        # Раскрывать можно только элементы, уже добавленные в дерево
+        self.expandAll()
+    
+    def _set_tooltip(self, item, column):
+        """Подсказка со значением при первом наведении"""
+        if column == 1 and not item.toolTip(1):
+            item.setToolTip(1, item.text(1))
+    
+    @staticmethod
+    @functools.lru_cache(maxsize=4096)
+    def _categorize(key_lower):
+        """Категория для ключа по первому сработавшему правилу (имена тегов повторяются от файла к файлу)"""
+        for category, pattern in MetadataTree._CATEGORY_RULES:
+            if pattern.search(key_lower):
+                return category
+        return "Other Metadata"
     
     def _get_category_color(self, category):
         """Цвета категорий"""
-        colors = {
-            "File Information": QColor(60, 60, 60),
-            "Camera & Lens": QColor(45, 85, 155),
-            "Capture Settings": QColor(35, 110, 75),
-            "GPS & Location": QColor(180, 130, 40),
-            "Date & Time": QColor(150, 75, 180),
-            "Image Properties": QColor(55, 115, 165),
-            "Color & Profiles": QColor(65, 170, 170),
-            "EXIF Data": QColor(200, 100, 100),
-            "RAW Information": QColor(220, 140, 50),
-            "OSINT Intelligence": QColor(255, 165, 0),  # Оранжевый для OSINT
-            "Other Metadata": QColor(100, 100, 100)
-        }
-        return colors.get(category, QColor(80, 80, 80))
+        return self._CATEGORY_COLORS.get(category, self._DEFAULT_COLOR)
+    
+    @classmethod
+    def _get_category_font(cls):
+        """Шрифт заголовков категорий"""
+        if cls._category_font is None:
+            cls._category_font = QFont("Segoe UI", 9, QFont.Weight.Bold)
+        return cls._category_font
     
     def _context_menu(self, pos):
         """Контекстное меню"""
@@ -205,11 +300,11 @@ class MetadataTree(QTreeWidget):
             if "OSINT" in item.text(0):
                 if "http" in item_text and "maps" in item_text:
                     maps_action = QAction("Open in Browser", self)
-                    maps_action.triggered.connect(lambda: webbrowser.open(item_text))
+                    maps_action.triggered.connect(lambda: QDesktopServices.openUrl(QUrl(item_text)))
                     menu.addAction(maps_action)
                 elif "Search" in item.text(0) and "http" in item_text:
                     search_action = QAction("Open Search", self)
-                    search_action.triggered.connect(lambda: webbrowser.open(item_text))
+                    search_action.triggered.connect(lambda: QDesktopServices.openUrl(QUrl(item_text)))
                     menu.addAction(search_action)
             
             menu.exec(self.mapToGlobal(pos))
@@ -219,22 +314,33 @@ class MetadataTree(QTreeWidget):
         QApplication.clipboard().setText(item.text(1))
 
 
-class ExtractionWorker(QObject):
-    """Worker для запуска тяжёлого анализа в отдельном потоке"""
-    finished = pyqtSignal(dict)
+class ExtractionSignals(QObject):
+    """Сигналы задач анализа (QRunnable не является QObject)"""
+    # Метаданные и сводка для строки состояния: {'osint_count': int, 'gps': bool}
+    finished = pyqtSignal(dict, dict)
     error = pyqtSignal(str)
 
-    def __init__(self, extractor, path):
+
+class ExtractionRunnable(QRunnable):
+    """Задача тяжёлого анализа для пула потоков"""
+    def __init__(self, extractor, path, signals):
         super().__init__()
         self.extractor = extractor
         self.path = path
+        self.signals = signals
 
     def run(self):
         try:
-            result = self.extractor.extract_osint_metadata(self.path)
-            self.finished.emit(result)
+            # Одиночный файл в GUI - извлекаем всё, включая MakerNotes
+            result = self.extractor.extract_osint_metadata(self.path, include_makernotes=True)
+            # Сводку считаем здесь, чтобы не проходить словарь в GUI-потоке
+            stats = {
+                'osint_count': sum(1 for key in result if key.startswith('OSINT_')),
+                'gps': 'GPS_Coordinates' in result,
+            }
+            self.signals.finished.emit(result, stats)
         except Exception as e:
-            self.error.emit(str(e))
+            self.signals.error.emit(str(e))
 
 class MainWindow(QMainWindow):
     """Главное окно - оптимизированное"""
@@ -242,10 +348,18 @@ class MainWindow(QMainWindow):
         super().__init__()
         from core import UltraMetadataExtractor
         
-        self.extractor = UltraMetadataExtractor()
+        # Повторное открытие того же файла отдаётся из кэша результатов
+        self.extractor = UltraMetadataExtractor(cache_results=True)
         self.current_file = None
         self.current_metadata = None
         
+        # Общий пул потоков вместо нового QThread на каждый файл
+        self.pool = QThreadPool.globalInstance()
+        self.pool.setMaxThreadCount(min(4, os.cpu_count() or 1))
+        self._signals = ExtractionSignals()
+        self._signals.finished.connect(self._on_extraction_finished)
+        self._signals.error.connect(self._on_extraction_error)
+        
         self._setup_ui()
     
     def _setup_ui(self):
@@ -388,21 +502,7 @@ class MainWindow(QMainWindow):
             # Блокируем UI действия
             self._set_ui_busy(True)
 
-            # Создаём поток и worker
-            self._thread = QThread()
-            self._worker = ExtractionWorker(self.extractor, path)
-            self._worker.moveToThread(self._thread)
-
-            self._thread.started.connect(self._worker.run)
-            self._worker.finished.connect(self._on_extraction_finished)
-            self._worker.error.connect(self._on_extraction_error)
-
-            # Очистка потоков после завершения
-            self._worker.finished.connect(self._thread.quit)
-            self._worker.finished.connect(self._worker.deleteLater)
-            self._thread.finished.connect(self._thread.deleteLater)
-
-            self._thread.start()
+            self.pool.start(ExtractionRunnable(self.extractor, path, self._signals))
 
         except Exception as e:
             QMessageBox.critical(self, "Error", f"Failed to start processing: {e}")
@@ -413,7 +513,7 @@ class MainWindow(QMainWindow):
         self._set_ui_busy(False)
         self.statusBar().showMessage("Error processing image")
 
-    def _on_extraction_finished(self, metadata):
+    def _on_extraction_finished(self, metadata, stats):
         try:
             path = None
             if 'File_Path' in metadata:
@@ -424,16 +524,13 @@ class MainWindow(QMainWindow):
             self.current_file = path
 
             file_name = os.path.basename(path) if path else 'Unknown'
-            osint_count = sum(1 for key in metadata.keys() if 'OSINT_' in key)
-            gps_present = any('GPS' in key and 'Coordinates' in key for key in metadata.keys())
-
-            status_msg = f"Loaded: {file_name} | Total: {len(metadata)} | OSINT: {osint_count}"
-            if gps_present:
+            status_msg = f"Loaded: {file_name} | Total: {len(metadata)} | OSINT: {stats['osint_count']}"
+            if stats['gps']:
                 status_msg += " | GPS Located"
 
             self.statusBar().showMessage(status_msg)
         except Exception as e:
-            logger.exception(f"Error updating UI after extraction: {e}")
+            logger.exception("Error updating UI after extraction: %s", e)
             self.statusBar().showMessage("Error updating UI")
         finally:
             self._set_ui_busy(False)
@@ -459,8 +556,13 @@ class MainWindow(QMainWindow):
                     "metadata": self.current_metadata
                 }
                 
-                with open(path, 'w', encoding='utf-8') as f:
-                    json.dump(data, f, indent=2, ensure_ascii=False)
+                # Сериализуем целиком и пишем одним вызовом
+                if orjson is not None:
+                    payload = orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+                else:
+                    payload = json.dumps(data, indent=2, ensure_ascii=False).encode('utf-8')
+                with open(path, 'wb', buffering=1 << 20) as f:
+                    f.write(payload)
                     
                 QMessageBox.information(self, "Success", f"Metadata exported to: {path}")
             except Exception as e:
@@ -485,10 +587,11 @@ class MainWindow(QMainWindow):
                 map_url = value
                 break
         
+        # QDesktopServices передаёт ссылку системе и не блокирует GUI-поток
         if map_url:
-            webbrowser.open(map_url)
+            QDesktopServices.openUrl(QUrl(map_url))
         elif map_file and os.path.exists(map_file):
-            webbrowser.open(f"file://{map_file}")
+            QDesktopServices.openUrl(QUrl.fromLocalFile(map_file))
         else:
             QMessageBox.information(self, "Map", "No location map available for this image")
     
@@ -0,0 +1,79 @@
+import hashlib
+import os
+import sys
+import tempfile
+import unittest
+
+import piexif
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import core
+
+
+def _make_jpeg(path):
+    exif = {
+        "0th": {
+            piexif.ImageIFD.Make: b"Canon",
+            piexif.ImageIFD.Model: b"EOS 5D",
+            piexif.ImageIFD.Software: b"1.10",
+            piexif.ImageIFD.XResolution: (72, 1),
+            piexif.ImageIFD.XMLPacket: b"<x:xmpmeta xmlns:x='adobe:ns:meta/'/>",
+            piexif.ImageIFD.XPComment: "hi".encode("utf-16le") + b"\x00\x00",
+        },
+        "Exif": {
+            piexif.ExifIFD.BodySerialNumber: b"0012345",
+            piexif.ExifIFD.UserComment: b"ASCII\x00\x00\x00hello world",
+            piexif.ExifIFD.ExifVersion: b"0232",
+            piexif.ExifIFD.ExposureTime: (1, 250),
+            piexif.ExifIFD.ExposureBiasValue: (-1, 3),
+            piexif.ExifIFD.ISOSpeedRatings: 100,
+        },
+        "GPS": {
+            piexif.GPSIFD.GPSLatitudeRef: b"N",
+            piexif.GPSIFD.GPSLatitude: ((55, 1), (45, 1), (1234, 100)),
+        },
+    }
+    Image.new("RGB", (8, 8)).save(path, exif=piexif.dump(exif))
+
+
+@unittest.skipIf(core.pyexiv2 is None, "pyexiv2 is not installed")
+class ExifBackendsTest(unittest.TestCase):
+    """pyexiv2 and exifread must produce the same EXIFDEEP output"""
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix=".jpg")
+        os.close(fd)
+        self.addCleanup(os.remove, self.path)
+        _make_jpeg(self.path)
+
+    def _extract(self, use_pyexiv2):
+        saved = core.pyexiv2
+        if not use_pyexiv2:
+            core.pyexiv2 = None
+        try:
+            extractor = core.UltraMetadataExtractor(hashes=(), create_map=False)
+            metadata = extractor.extract_metadata(self.path)
+        finally:
+            core.pyexiv2 = saved
+        return {k: v for k, v in metadata.items() if k.startswith("EXIFDEEP_")}
+
+    def test_same_output(self):
+        exiv2 = self._extract(True)
+        exifread = self._extract(False)
+        self.assertEqual(exiv2, exifread)
+        self.assertEqual(exiv2["EXIFDEEP_EXIF BodySerialNumber"], "0012345")
+        self.assertEqual(exiv2["EXIFDEEP_Image Software"], "1.10")
+        self.assertIn("EXIFDEEP_Image ApplicationNotes", exiv2)
+        self.assertNotIn("EXIFDEEP_Image XMLPacket", exiv2)
+
+    def test_camera_serial(self):
+        enhancer = core.OSINTEnhancer(hashes=(), create_map=False)
+        camera = enhancer._camera_osint_analysis(enhancer._build_index(self._extract(True)))
+        self.assertEqual(camera["OSINT_Camera_Serial"], "0012345")
+        self.assertEqual(camera["OSINT_Serial_Hash_MD5"], hashlib.md5(b"0012345").hexdigest())
+
+
+if __name__ == "__main__":
+    unittest.main()